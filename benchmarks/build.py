@@ -0,0 +1,291 @@
+#!/usr/bin/env jython
+"""
+Builds a synthetic project end to end with :class:`codegen.renderer.Builder`
+and reports how long each scenario takes, in total and per stage (model
+load, group compile, model injection, render, each extension and write).
+
+The project has one ``entities.*`` fan-out template rendering a java class
+per entity.  Each class has ``--fields`` fields nested ``--depth`` levels deep
+and ``--sections`` custom sections, which are filled in after the first
+build so that every later build has custom code to carry over.
+
+The scenarios are:
+
+- ``cold``: no build manifest and empty caches, so everything is rendered
+- ``noop``: nothing has changed since the last build
+- ``change``: a single entity of the model has changed
+
+Each scenario starts with empty in-process caches, as a fresh ``codegen``
+process would, unless ``--warm`` is given to measure a build server.  Run
+from the root of the repository:
+
+    jython benchmarks/build.py [--entities N] [--fields N] [--depth N]
+        [--sections N] [--repeat N] [--jobs N] [--warm] [--json FILE]
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from codegen import __version__
+from codegen.config import (
+        CommandLineConfig,
+        DefaultConfig,
+        FileConfig,
+        MergedConfig,
+    )
+from codegen.models import model_registry
+from codegen.renderer import Builder
+from codegen.stats import build_stats
+from codegen.stringtemplate import group_cache
+from codegen.util import clear_file_hashes
+
+
+SCENARIOS = ('cold', 'noop', 'change')
+
+GROUP = """
+entity(name, fields, sections) ::= <<
+public class <name> {
+    <fields:field(); separator="\\n">
+
+    <sections:section(); separator="\\n\\n">
+}
+>>
+
+field(f) ::= <<
+private <f.type> <f.name>;<if(f.children)>
+/* <f.name> holds:
+    <f.children:field(); separator="\\n">
+*/<endif>
+>>
+
+section(s) ::= <<
+// [[@ section <s> @]]
+// [[@ end @]]
+>>
+"""
+
+CUSTOM_CODE = "\n    public void custom() {\n    }\n// "
+
+
+def make_field(name, depth, width=2):
+    field = {'name': name, 'type': 'String'}
+    if depth > 0:
+        field['children'] = [make_field('%s_%d' % (name, i), depth - 1, width)
+                              for i in range(width)]
+    return field
+
+def make_model(options):
+    entities = {}
+    for i in range(options.entities):
+        name = 'Entity%d' % (i,)
+        entities[name] = {
+            'name': name,
+            'fields': [make_field('field%d' % (j,), options.depth)
+                       for j in range(options.fields)],
+            'sections': ['custom%d' % (j,) for j in range(options.sections)],
+        }
+    return {'entities': entities}
+
+
+class Project(object):
+    """
+    The files of a synthetic project in a temporary directory
+    """
+    def __init__(self, work_dir, options):
+        self.work_dir = work_dir
+        self.options = options
+        self.out_dir = os.path.join(work_dir, 'out')
+        self.template_dir = os.path.join(work_dir, 'templates')
+        self.model_path = os.path.join(work_dir, 'model.yaml')
+        self.config_path = os.path.join(work_dir, 'codegen.yaml')
+        self.model = make_model(options)
+        self.runs = 0
+
+    def generate(self):
+        os.makedirs(self.out_dir)
+        os.makedirs(self.template_dir)
+        with open(os.path.join(self.template_dir, 'entity.stg'), 'w') as fh:
+            fh.write(GROUP)
+        self.write_model()
+
+        with open(self.config_path, 'w') as fh:
+            yaml.safe_dump({
+                'baseDir': self.work_dir,
+                'templateDir': self.template_dir,
+                'modelFile': self.model_path,
+                'jobs': self.options.jobs,
+                'templates': [{
+                    'name': 'entity',
+                    'renderPath': os.path.join(self.out_dir,
+                                               '<modelKey>.java'),
+                    'forModelPaths': ['entities.*'],
+                }],
+            }, fh, default_flow_style=False)
+
+    def write_model(self):
+        with open(self.model_path, 'w') as fh:
+            yaml.safe_dump(self.model, fh, default_flow_style=False)
+
+    def change_entity(self):
+        """
+        Changes the type of the first field of one entity
+        """
+        field = self.model['entities']['Entity0']['fields'][0]
+        field['type'] = 'Integer' if field['type'] == 'String' else 'String'
+        self.write_model()
+
+    def fill_sections(self):
+        """
+        Puts some custom code in every section of every output
+        """
+        for filename in os.listdir(self.out_dir):
+            path = os.path.join(self.out_dir, filename)
+            with open(path, 'r') as fh:
+                text = fh.read()
+            with open(path, 'w') as fh:
+                fh.write(text.replace('\n// [[@ end @]]',
+                                      CUSTOM_CODE + '[[@ end @]]'))
+
+    def forget_build(self):
+        for name in ('.codegen-manifest', '.codegen-cache'):
+            path = os.path.join(self.work_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def build(self):
+        """
+        Runs a build and returns its wall time and build stats
+        """
+        self.runs += 1
+        stats_path = os.path.join(self.work_dir, 'stats-%d.json' % (self.runs,))
+        cl_cfg = CommandLineConfig(['-c', self.config_path,
+                                    '--stats-json', stats_path])
+
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = time.time()
+            build_stats.reset(enabled=True)
+            with build_stats.phase('config load'):
+                config = MergedConfig(cl_cfg, FileConfig(self.config_path),
+                                      DefaultConfig())
+            Builder(config).render_templates()
+            wall = time.time() - start
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            build_stats.reset(enabled=False)
+
+        with open(stats_path, 'r') as fh:
+            return wall, json.load(fh)
+
+
+def clear_caches():
+    model_registry.clear()
+    group_cache.clear()
+    clear_file_hashes()
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def run_scenario(project, scenario, options):
+    runs = []
+    for i in range(options.repeat):
+        if scenario == 'cold':
+            project.forget_build()
+        elif scenario == 'change':
+            project.change_entity()
+
+        if not options.warm:
+            clear_caches()
+        runs.append(project.build())
+
+    walls = [wall for wall, stats in runs]
+    names = set(name for wall, stats in runs for name in stats['phases'])
+    caches = runs[-1][1]['caches']
+
+    return {
+        'wall': median(walls),
+        'wall_min': min(walls),
+        'phases': dict((name, median([stats['phases'].get(name, {})
+                                      .get('wall', 0.0)
+                                      for wall, stats in runs]))
+                       for name in names),
+        'caches': caches,
+        'rendered': caches['manifest']['misses'],
+    }
+
+def report(results):
+    print "codegen %s on %s %s" % (results['version'],
+            results['python'], results['platform'])
+    print "  %s" % (', '.join('%s=%s' % p
+                              for p in sorted(results['params'].items())),)
+    for scenario in SCENARIOS:
+        result = results['scenarios'][scenario]
+        print "%-8s %8.3fs median, %8.3fs min, %d templates rendered" % (
+                scenario, result['wall'], result['wall_min'],
+                result['rendered'])
+        for name, wall in sorted(result['phases'].items(),
+                                 key=lambda p: p[1], reverse=True):
+            print "    %-26s %8.3fs" % (name, wall)
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--entities", type="int", default=200)
+    parser.add_option("--fields", type="int", default=10)
+    parser.add_option("--depth", type="int", default=2)
+    parser.add_option("--sections", type="int", default=3)
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--jobs", type="int", default=1)
+    parser.add_option("--warm", action="store_true", default=False,
+            help="keep the in-process caches between builds")
+    parser.add_option("--json", dest="json_file",
+            help="also write the results to this file")
+    (options, args) = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        project = Project(work_dir, options)
+        project.generate()
+
+        # Render once to have outputs to put custom code in, and once more to
+        # record the filled in outputs in the manifest
+        project.build()
+        project.fill_sections()
+        project.build()
+
+        results = {
+            'version': __version__,
+            'python': '%s %s' % (platform.python_implementation(),
+                                 platform.python_version()),
+            'platform': platform.platform(),
+            'params': dict((k, getattr(options, k)) for k in
+                           ('entities', 'fields', 'depth', 'sections',
+                            'repeat', 'jobs', 'warm')),
+            'scenarios': dict((scenario,
+                               run_scenario(project, scenario, options))
+                              for scenario in SCENARIOS),
+        }
+    finally:
+        shutil.rmtree(work_dir)
+
+    report(results)
+    if options.json_file:
+        with open(options.json_file, 'w') as fh:
+            json.dump(results, fh, sort_keys=True, indent=1)
+
+
+if __name__ == '__main__':
+    main()
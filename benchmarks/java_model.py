@@ -0,0 +1,84 @@
+#!/usr/bin/env jython
+"""
+Compares rendering a deep model through the python ``DictModelAdaptor`` with
+rendering the same model converted into Java collections (``--java-model``).
+
+Run from the root of the repository:
+
+    jython benchmarks/java_model.py [--depth N] [--width N] [--repeat N]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from codegen.models import TemplateModel, DictModelSource
+from codegen.stringtemplate import STTemplate
+
+
+GROUP = """
+tree(root) ::= <<
+<node(root)>
+>>
+
+node(n) ::= <<
+<n.name>: <n.value> <n.missing>
+<n.children:node()>
+>>
+"""
+
+def make_tree(depth, width, name='n'):
+    node = {'name': name, 'value': depth * width}
+    if depth > 0:
+        node['children'] = [make_tree(depth - 1, width, '%s.%d' % (name, i))
+                            for i in range(width)]
+    return node
+
+def render(group_path, model, java_model, repeat):
+    start = time.time()
+    for i in range(repeat):
+        STTemplate('tree', group_path, 'unused', model,
+                   java_model=java_model).render()
+    return (time.time() - start) / repeat
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--depth", type="int", default=6)
+    parser.add_option("--width", type="int", default=4)
+    parser.add_option("--repeat", type="int", default=10)
+    (options, args) = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        group_path = os.path.join(tmp_dir, 'tree.stg')
+        with open(group_path, 'w') as fh:
+            fh.write(GROUP)
+
+        model = TemplateModel(DictModelSource(
+                {'root': make_tree(options.depth, options.width)}))
+
+        # Warm up the JIT and pay for the one-off conversion outside the timing
+        render(group_path, model, False, 1)
+        start = time.time()
+        render(group_path, model, True, 1)
+        conversion = time.time() - start
+
+        adaptor = render(group_path, model, False, options.repeat)
+        java = render(group_path, model, True, options.repeat)
+
+        print "depth=%d width=%d repeat=%d" % (options.depth, options.width,
+                options.repeat)
+        print "  dict adaptor:  %8.1f ms/render" % (adaptor * 1000,)
+        print "  java model:    %8.1f ms/render (first render incl. "\
+              "conversion: %.1f ms)" % (java * 1000, conversion * 1000)
+        print "  speedup:       %8.2fx" % (adaptor / java,)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
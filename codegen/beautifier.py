@@ -1,4 +1,16 @@
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+
+from .consolewriter import cw
+from .exceptions import CodegenError
+from .util import hash_file, hash_text
+
+
+class BeautifierError(CodegenError):
+    pass
 
 
 class Beautifier(object):
@@ -14,11 +26,40 @@ class Beautifier(object):
 
         subcls = ext_to_beautifier.get(split_path[1], None)
 
-        return (subcls() if subcls is not None else None)
+        return (batcher_for(subcls) if subcls is not None else None)
+
+    # The configuration file of the formatter, if it has one
+    config_file = None
+
+    def process(self, text):
+        raise NotImplementedError("You must override process in the "
+            "beautifier class %s" % (self.__class__,))
+
+    def fingerprint(self):
+        """
+        A hash of everything other than the text that determines what the
+        formatter produces: its commands and its configuration file.
+        """
+        parts = [self.__class__.__name__, repr(getattr(self, 'command', None)),
+                 repr(getattr(self, 'batch_command', None))]
+        if self.config_file is not None and os.path.exists(self.config_file):
+            parts.append(hash_file(self.config_file))
+
+        return hash_text('\0'.join(parts))
+
+    def process_batch(self, texts):
+        """
+        Formats several texts at once.  Subclasses whose formatter can handle
+        many files per invocation should override this; it should raise
+        :class:`BeautifierError` if the batch could not be formatted.
+        """
+        return [self.process(text) for text in texts]
 
 
 class JavaBeautifier(Beautifier):
+    config_file = 'sun.cfg'
     command = 'jacobe -quiet -stdout -cfg=sun.cfg -'
+    batch_command = ['jacobe', '-quiet', '-overwrite', '-cfg=sun.cfg']
 
     def process(self, text):
         proc = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE,
@@ -30,4 +71,120 @@ class JavaBeautifier(Beautifier):
 
         return output
 
-        
+    def process_batch(self, texts):
+        """
+        Writes the texts to a temporary directory and formats all of them in
+        place with a single jacobe process.
+        """
+        tmp_dir = tempfile.mkdtemp(prefix='codegen-jacobe-')
+        try:
+            paths = []
+            for i, text in enumerate(texts):
+                path = os.path.join(tmp_dir, 'Source%d.java' % (i,))
+                with open(path, 'w') as fh:
+                    fh.write(text)
+                paths.append(path)
+
+            try:
+                proc = subprocess.Popen(self.batch_command + paths,
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                (output, error) = proc.communicate()
+            except OSError as e:
+                raise BeautifierError("Cannot run %s: %s" %
+                        (self.batch_command[0], e))
+
+            if proc.returncode != 0:
+                raise BeautifierError("%s exited with status %d: %s" %
+                        (self.batch_command[0], proc.returncode, error))
+
+            results = []
+            for path in paths:
+                with open(path, 'r') as fh:
+                    result = fh.read()
+                if len(result) == 0:
+                    raise BeautifierError("%s produced no output for %s" %
+                            (self.batch_command[0], path))
+                results.append(result)
+
+            return results
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class BatchingBeautifier(object):
+    """
+    Formats texts with a beautifier in batches of up to ``max_batch`` using
+    :meth:`Beautifier.process_batch`, so that one formatter process handles
+    many files.  The builder collects the outputs that need formatting from
+    the whole build and hands them over together.  Batches that fail are
+    formatted one file at a time instead.
+    """
+    max_batch = 100
+
+    # The FormatCache results are looked up in first, see set_format_cache()
+    cache = None
+
+    def __init__(self, beautifier):
+        self.beautifier = beautifier
+
+    def process(self, text):
+        return self.process_all([text])[0]
+
+    def process_all(self, texts):
+        """
+        Returns the formatted version of each of ``texts``
+        """
+        cache = self.cache
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        to_format = []
+        for i, text in enumerate(texts):
+            if cache is not None:
+                keys[i] = cache.key(self.beautifier, text)
+                results[i] = cache.get(keys[i])
+            if results[i] is None:
+                to_format.append(i)
+
+        for start in range(0, len(to_format), self.max_batch):
+            batch = to_format[start:start + self.max_batch]
+            formatted = self._format([texts[i] for i in batch])
+            for i, result in zip(batch, formatted):
+                results[i] = result
+                # Text that comes back unchanged may mean the formatter
+                # failed, so it is not worth remembering
+                if cache is not None and result != texts[i]:
+                    cache.put(keys[i], result)
+
+        return results
+
+    def _format(self, texts):
+        if len(texts) == 1:
+            return [self.beautifier.process(texts[0])]
+
+        try:
+            return self.beautifier.process_batch(texts)
+        except Exception as e:
+            cw.warning("Batch formatting failed, formatting files one at a "
+                    "time: %s" % (e,))
+            return [self.beautifier.process(text) for text in texts]
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def batcher_for(beautifier_cls):
+    """
+    Returns the process wide :class:`BatchingBeautifier` for a beautifier
+    class
+    """
+    with _batchers_lock:
+        if beautifier_cls not in _batchers:
+            _batchers[beautifier_cls] = BatchingBeautifier(beautifier_cls())
+        return _batchers[beautifier_cls]
+
+def set_format_cache(cache):
+    """
+    Sets the :class:`FormatCache` every batching beautifier uses, or
+    ``None`` to always run the formatter.
+    """
+    BatchingBeautifier.cache = cache
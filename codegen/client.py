@@ -0,0 +1,88 @@
+import json
+import os
+import socket
+import stat
+import sys
+
+"""
+A thin client for ``codegen --server``.  It only uses the standard library,
+so it can be run by a plain python interpreter and avoid the startup cost of
+the JVM entirely.  See :mod:`codegen.server` for the protocol.
+"""
+
+DEFAULT_SOCKET_FILENAME = '.codegen.sock'
+
+
+def token_path(socket_path):
+    """
+    The file the server keeps the token that every request has to carry in,
+    which only the user running the server can read
+    """
+    return socket_path + '.token'
+
+def read_token(socket_path):
+    with open(token_path(socket_path), 'r') as fh:
+        return fh.read().strip()
+
+
+def connect(socket_path):
+    if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    else:
+        # A Jython server writes the loopback address it listens on instead
+        with open(socket_path, 'r') as fh:
+            host, port = fh.read().strip().rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+
+    return sock
+
+
+def forward(argv, socket_path=DEFAULT_SOCKET_FILENAME):
+    """
+    Sends a build with the command line arguments ``argv`` to the server,
+    copies its output to stdout and stderr and returns its exit status.
+    """
+    token = read_token(socket_path)
+    sock = connect(socket_path)
+    try:
+        fh = sock.makefile('rw')
+        fh.write(json.dumps({'argv': argv, 'cwd': os.getcwd(),
+                             'token': token}) + '\n')
+        fh.flush()
+
+        streams = {'out': sys.stdout, 'err': sys.stderr}
+        for line in fh:
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            streams[message['stream']].write(message['data'])
+    finally:
+        sock.close()
+
+    sys.stderr.write("Error: the codegen server closed the connection\n")
+    return 1
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # The socket option is also understood by the server, so it is passed on
+    socket_path = DEFAULT_SOCKET_FILENAME
+    for i, arg in enumerate(argv):
+        if arg == '--socket' and i + 1 < len(argv):
+            socket_path = argv[i + 1]
+        elif arg.startswith('--socket='):
+            socket_path = arg.split('=', 1)[1]
+
+    try:
+        return forward(argv, socket_path)
+    except (socket.error, IOError, OSError) as e:
+        sys.stderr.write("Error: cannot reach the codegen server at %s: %s\n"
+                % (socket_path, e))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 import os
 from optparse import OptionParser
+from .client import DEFAULT_SOCKET_FILENAME
 from .exceptions import InvalidConfigurationError, CodegenError
+from .formatcache import DEFAULT_MAX_MEGABYTES
+from .stats import DEFAULT_SLOWEST_COUNT
 from .util import load_yaml
 from yaml import YAMLError
 
@@ -8,13 +11,19 @@ from yaml import YAMLError
 DEFAULT_CONFIG_FILENAME = 'codegen.yaml'
 DEFAULT_TEMPLATE_DIR = 'codegen_tmpl'
 DEFAULT_MODEL_FILENAME = 'codegen_model.yaml'
+DEFAULT_CACHE_DIR = '.codegen-cache'
+DEFAULT_TEMPLATE_TYPE = 'st'
 
 
 class CommandLineConfig(object):
-    def __init__(self):
+    def __init__(self, argv=None):
+        """
+        :param argv: The arguments to parse, ``sys.argv[1:]`` by default
+        """
         usage = """usage: %prog [options] TEMPLATES...
         Renders the templates in templates.yaml.  TEMPLATES indicates the names of
-        the templates to render, if present.  
+        the templates to render, if present, and may contain glob patterns such
+        as dao_*.
         """
         parser = OptionParser(usage=usage)
 
@@ -28,14 +37,74 @@ class CommandLineConfig(object):
                 help="force the templates to rerender")
         parser.add_option("-p", "--pretty", action="store_true", dest="pretty_print",
                 help="run the output through an appropriate code formatter if available")
+        parser.add_option("--no-format-cache", action="store_false",
+                dest="format_cache",
+                help="always run the code formatter instead of reusing the "
+                     "cached result for text it has formatted before")
+        parser.add_option("--cache-dir", dest="cache_dir",
+                help="the directory codegen keeps its caches in")
+        parser.add_option("--model-snapshots", action="store_true",
+                dest="model_snapshots",
+                help="keep a pickled copy of each parsed model in the cache "
+                     "directory and load that while the model file is "
+                     "unchanged")
+        parser.add_option("--java-model", action="store_true",
+                dest="java_model",
+                help="convert each model into Java collections once so that "
+                     "StringTemplate reads it without python callbacks")
         parser.add_option("-s", "--model-file", dest="model_file", 
                 help="filename for the model(s) to be used when processing the templates")
         parser.add_option("-t", "--template-dir", dest="template_dir",
                 help="The directory the template files are in.")
+        parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                help="the number of templates to render concurrently")
+        parser.add_option("--transactional", action="store_true",
+                dest="transactional",
+                help="stage all output and only move it into place once "
+                     "every template has rendered successfully")
+        parser.add_option("--shard", dest="shard", metavar="I/N",
+                help="only render the templates of shard I of N, e.g. 3/8, "
+                     "recording them in a manifest of their own")
+        parser.add_option("--shard-stats", dest="shard_stats", metavar="FILE",
+                help="balance the shards by the render times in this "
+                     "--stats-json file of an earlier build")
+        parser.add_option("--merge-shards", action="store_true",
+                dest="merge_shards", default=False,
+                help="combine the manifests and outputs of the shards of a "
+                     "sharded build, which are in the directories given as "
+                     "arguments or the base directory")
+        parser.add_option("--server", action="store_true", dest="server",
+                default=False,
+                help="stay resident and render builds sent by codegen-client, "
+                     "keeping parsed models and compiled groups warm")
+        parser.add_option("--socket", dest="socket",
+                default=DEFAULT_SOCKET_FILENAME,
+                help="the socket the server listens on")
+        parser.add_option("-l", "--list", action="store_true", dest="list",
+                default=False,
+                help="list each template and the path it renders to without "
+                     "rendering anything")
+        parser.add_option("--stats", action="store_true", dest="stats",
+                default=False,
+                help="print the time spent in each phase of the build, the "
+                     "cache hits and misses and the slowest templates")
+        parser.add_option("--stats-json", dest="stats_json", default="",
+                metavar="FILE",
+                help="write the build stats to FILE as JSON")
+        parser.add_option("--stats-top", dest="stats_top", type="int",
+                default=DEFAULT_SLOWEST_COUNT,
+                help="the number of slowest templates in the build stats")
+        parser.add_option("-w", "--watch", action="store_true", dest="watch",
+                default=False,
+                help="keep running and re-render the templates affected by "
+                     "any change to the config, model or group files")
+        parser.add_option("--watch-interval", dest="watch_interval",
+                type="float", default=1.0,
+                help="seconds between checks for changes in watch mode")
         parser.add_option("-v", "--verbose", dest="verbose",
                 action="store_true", default=False)
 
-        (self.options, self.to_render) = parser.parse_args()
+        (self.options, self.to_render) = parser.parse_args(argv)
 
     def __getitem__(self, key):
         if key == 'to_render':
@@ -79,6 +148,14 @@ class FileConfig(object):
         d['base_dir'] = self.config.get('baseDir', None)
         d['template_dir'] = self.config.get('templateDir', None)
         d['template_type'] = self.config.get('templateType', None)
+        d['jobs'] = self.config.get('jobs', None)
+        d['transactional'] = self.config.get('transactional', None)
+        d['cache_dir'] = self.config.get('cacheDir', None)
+        d['format_cache'] = self.config.get('formatCache', None)
+        d['format_cache_size'] = self.config.get('formatCacheSize', None)
+        d['java_model'] = self.config.get('javaModel', None)
+        d['model_snapshots'] = self.config.get('modelSnapshots', None)
+        d['shard_stats'] = self.config.get('shardStats', None)
 
         d['templates'] = []
         for t in self.config.get('templates', []):
@@ -92,6 +169,15 @@ class FileConfig(object):
                     "configuration: %s" % (e,))
 
             t_dct['for_model_paths'] = t.get('forModelPaths', None)
+            t_dct['for_query'] = t.get('forQuery', None)
+            if t_dct['for_model_paths'] and t_dct['for_query']:
+                raise InvalidConfigurationError(
+                    "Template %s cannot have both forModelPaths and forQuery" %
+                    (t_dct['name'],))
+            if 'modelFile' in t:
+                t_dct['model_file'] = t['modelFile']
+            if 'templateType' in t:
+                t_dct['template_type'] = t['templateType']
 
             d['templates'].append(t_dct)
 
@@ -103,10 +189,23 @@ class DefaultConfig(object):
         'template_dir': DEFAULT_TEMPLATE_DIR,
         'pretty_print': False,
         'model_file': DEFAULT_MODEL_FILENAME,
-        'base_dir': os.path.abspath('.'),
+        'jobs': 1,
+        'transactional': False,
+        'cache_dir': DEFAULT_CACHE_DIR,
+        'format_cache': True,
+        'format_cache_size': DEFAULT_MAX_MEGABYTES,
+        'java_model': False,
+        'model_snapshots': False,
+        'template_type': DEFAULT_TEMPLATE_TYPE,
+        'shard': None,
+        'shard_stats': None,
     }
 
     def __getitem__(self, key):
+        # Resolved when asked for, since a server process changes its working
+        # directory for every build it runs
+        if key == 'base_dir':
+            return os.path.abspath('.')
         return self.default_config[key]
         
 
@@ -1,23 +1,53 @@
+import threading
+
 
 class ConsoleWriter(object):
     def __init__(self):
         self.indent = 0
         self._debug = True
+        self._local = threading.local()
 
     def error(self, text):
-        print ' '*self.indent + 'Error: %s' % (text,)
+        self._write(' '*self.indent + 'Error: %s' % (text,))
 
     def warning(self, text):
-        print ' '*self.indent + 'Warning: %s' % (text,)
+        self._write(' '*self.indent + 'Warning: %s' % (text,))
 
     def debug(self, text):
         if self._debug:
-            print ' '*self.indent + 'Debug: ' + text
+            self._write(' '*self.indent + 'Debug: ' + text)
 
     def output(self, text, add_indent=False):
-        print ' '*self.indent + text
+        self._write(' '*self.indent + text)
         if add_indent:
             self.indent += 2
 
     def reset(self):
         self.indent -= 2
+
+    def capture(self):
+        """
+        Buffers every message written from the current thread until
+        :meth:`end_capture` is called, so that work done on worker threads can
+        be reported in a deterministic order with :meth:`replay`.
+        """
+        self._local.buffer = []
+
+    def end_capture(self):
+        lines = getattr(self._local, 'buffer', None) or []
+        self._local.buffer = None
+        return lines
+
+    def replay(self, lines):
+        for line in lines:
+            self._write(line)
+
+    def _write(self, line):
+        buf = getattr(self._local, 'buffer', None)
+        if buf is not None:
+            buf.append(line)
+        else:
+            print line
+
+
+cw = ConsoleWriter()
@@ -1,6 +1,8 @@
 import re
 import os
 
+from ..beautifier import Beautifier
+from ..consolewriter import cw
 from .base import RendererExtension
 from .sections import CustomSectionsExtension 
 
@@ -13,7 +15,9 @@ class BannerExtension(RendererExtension):
         Only modifications in the specially marked sections will be preserved by
         the generator.""")
 
-    def post_render(self, output):
+    needs_full_text = False
+
+    def banner(self):
         ext_to_comment_start = {
             'pm': '#',
             'py': '#',
@@ -29,16 +33,41 @@ class BannerExtension(RendererExtension):
         banner = (re.sub('(?m)^[ ]*', comment_start + ' ', self.banner_text)
                    .format(template_path=os.path.basename(self.template.name)))
 
-        return "%s\n%s" % (banner, output)
+        return banner
+
+    def post_render(self, output):
+        return "%s\n%s" % (self.banner(), output)
+
+    def post_render_chunks(self, chunks):
+        yield self.banner() + "\n"
+        for chunk in chunks:
+            yield chunk
 
 
 class BeautifyingExtension(RendererExtension):
-    def post_render(self, output):
+    beautifier = None
+
+    # Formatters need the whole text, but everything else streams past
+    @property
+    def needs_full_text(self):
+        return self.beautifier is not None
+
+    # Outputs are formatted in batches from the whole build
+    @property
+    def batcher(self):
+        return self.beautifier
+
+    def pre_render(self):
         if self.template.pretty:
-            beautifier = Beautifier.by_extension(self.template.render_path)
-            if beautifier is None:
+            self.beautifier = Beautifier.by_extension(self.template.render_path)
+            if self.beautifier is None:
                 cw.warning('Skipping pretty print: formatter not found for filetype.')
-            else:
-                output = beautifier.process(output)
+
+    def post_render(self, output):
+        if self.beautifier is not None:
+            output = self.beautifier.process(output)
 
         return output
+
+    def post_render_chunks(self, chunks):
+        return chunks
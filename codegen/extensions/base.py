@@ -9,7 +9,22 @@ class RendererExtension(object):
     can store state on ``self`` in the ``pre_render`` method and it will be
     available to the ``post_render`` method for that same template but none
     others. 
+
+    Outputs stream through the extensions as chunks of text.  Extensions that
+    can work a chunk at a time set ``needs_full_text`` to ``False`` and
+    implement ``post_render_chunks``; the others are handed the whole output
+    at once in ``post_render``.
+
+    An extension that works best on many outputs at once, like a formatter,
+    returns an object with ``max_batch`` and ``process_all(texts)`` from
+    ``batcher``.  The renderer then stops at the extension and the builder
+    collects the outputs waiting for it from the whole build, processes them
+    together and runs the remaining extensions afterwards.
     """
+    needs_full_text = True
+
+    batcher = None
+
     def __init__(self, template):
         self.template = template
 
@@ -19,4 +34,11 @@ class RendererExtension(object):
     def post_render(self, output):
         raise NotImplementedError("You must override post_render in the "
             "renderer extension class %s" % (self.__class__,))
-        
+
+    def post_render_chunks(self, chunks):
+        """
+        Returns an iterable of the processed chunks of the output, given an
+        iterable of its chunks.  Only called if ``needs_full_text`` is false.
+        """
+        raise NotImplementedError("You must override post_render_chunks in "
+            "the renderer extension class %s" % (self.__class__,))
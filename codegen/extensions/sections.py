@@ -1,10 +1,34 @@
+import hashlib
 import re
 
+try:
+    import mmap
+except ImportError:
+    # Jython has no mmap module
+    mmap = None
+
 from . import RendererExtension
+from ..consolewriter import cw
+from ..util import hash_text, read_chunks
+
+
+CUSTOM_START_DELIM_REGEX = r'\[\[@ section (?P<name>[\w\d_-]+) @\]\]'
+CUSTOM_END_DELIM_REGEX = r'\[\[@ end @\]\]' 
+
+SECTION_REGEX = re.compile(CUSTOM_START_DELIM_REGEX
+        + r'(?P<content>.*?)'  # Section text
+        + CUSTOM_END_DELIM_REGEX,  # end delimiter
+        re.DOTALL | re.MULTILINE)
+
+SECTION_START_REGEX = re.compile(CUSTOM_START_DELIM_REGEX)
+SECTION_END_DELIM = '[[@ end @]]'
 
+# How far back a section start delimiter that is split between two chunks is
+# looked for
+MAX_START_DELIM_LENGTH = 256
 
-CUSTOM_START_DELIM_REGEX = r'\[\[@ section (?P<name>[\w\d_-]+) @]]'
-CUSTOM_END_DELIM_REGEX = r'\[\[@ end @]]' 
+# The kinds of token scan_sections splits text into
+TEXT, SECTION_START, SECTION_CONTENT, SECTION_END = range(4)
 
 class CustomSection(object):
     def __init__(self, name, content):
@@ -14,66 +38,252 @@ class CustomSection(object):
     def __unicode__(self):
         return "CustomSection (%s)" % (self.name,)
 
-    def replace(self, output):
-        regex = re.compile(
-                r'\[\[@ section %s @]].*?[[@ end @]]' % (self.name,)
-            , re.DOTALL | re.MULTILINE)
-        return regex.sub(r'[[@ section %s @]]%s[[@ end @]]' % (self.name,
-            self.content), output)
+    def delimited(self):
+        """
+        Returns the section content wrapped in its delimiters
+        """
+        return '[[@ section %s @]]%s[[@ end @]]' % (self.name, self.content)
 
-class CustomSectionsExtension(RendererExtension):
-    def sections_iter(self, output):
-        section_regex = re.compile(CUSTOM_START_DELIM_REGEX
-                + r'(?P<content>.*?)'  # Section text
-                + CUSTOM_END_DELIM_REGEX,  # end delimiter
-                re.DOTALL | re.MULTILINE)
 
-        start_pos = 0
-        while True:
-            match = section_regex.search(output, start_pos)
+def tokenize(text):
+    """
+    Splits ``text`` in a single pass into a list of the plain text between
+    custom sections and :class:`CustomSection` instances for the sections
+    themselves.
+    """
+    tokens = []
+    pos = 0
+    for match in SECTION_REGEX.finditer(text):
+        if match.start() > pos:
+            tokens.append(text[pos:match.start()])
+        tokens.append(CustomSection(match.group('name'),
+                                    match.group('content')))
+        pos = match.end()
+
+    if pos < len(text):
+        tokens.append(text[pos:])
+
+    return tokens
+
+
+def _partial_suffix(buf, delim):
+    """
+    Returns the length of the longest end of ``buf`` that ``delim`` starts
+    with, i.e. how much of ``buf`` may be the start of a split ``delim``
+    """
+    for n in range(min(len(delim) - 1, len(buf)), 0, -1):
+        if buf.endswith(delim[:n]):
+            return n
+    return 0
+
+def _start_tail(buf):
+    """
+    Returns the index from which ``buf`` may hold the start of a section
+    start delimiter that continues in the next chunk
+    """
+    pos = buf.rfind('[[@')
+    if pos != -1 and len(buf) - pos < MAX_START_DELIM_LENGTH:
+        return pos
+    return len(buf) - _partial_suffix(buf, '[[@')
+
+def scan_sections(chunks):
+    """
+    Splits a stream of text chunks into a stream of ``(kind, text, name)``
+    tokens, where ``kind`` is ``TEXT`` for the text between custom sections,
+    ``SECTION_START`` and ``SECTION_END`` for their delimiters and
+    ``SECTION_CONTENT`` for (pieces of) their content.  ``name`` is the name
+    of the section for ``SECTION_START`` tokens.  The sections are the same
+    as those :data:`SECTION_REGEX` finds, but only a chunk and a delimiter are
+    ever held in memory.  A section that is never ended has no
+    ``SECTION_END`` token, and should be taken as plain text.
+    """
+    buf = ''
+    inside = False
+    for chunk in chunks:
+        buf += chunk
+        while buf:
+            if inside:
+                pos = buf.find(SECTION_END_DELIM)
+                if pos == -1:
+                    end = len(buf) - _partial_suffix(buf, SECTION_END_DELIM)
+                    if end > 0:
+                        yield SECTION_CONTENT, buf[:end], None
+                        buf = buf[end:]
+                    break
+
+                if pos > 0:
+                    yield SECTION_CONTENT, buf[:pos], None
+                end = pos + len(SECTION_END_DELIM)
+                yield SECTION_END, buf[pos:end], None
+                buf = buf[end:]
+                inside = False
+            else:
+                match = SECTION_START_REGEX.search(buf)
+                if match is None:
+                    end = _start_tail(buf)
+                    if end > 0:
+                        yield TEXT, buf[:end], None
+                        buf = buf[end:]
+                    break
+
+                if match.start() > 0:
+                    yield TEXT, buf[:match.start()], None
+                yield SECTION_START, match.group(0), match.group('name')
+                buf = buf[match.end():]
+                inside = True
+
+    if buf:
+        yield (SECTION_CONTENT if inside else TEXT), buf, None
 
-            if match is None:
-                break
 
-            start_pos = match.end()
-            yield CustomSection(
-                    match.groupdict()['name'], 
-                    match.groupdict()['content'],
-                )
+class SectionIndexer(object):
+    """
+    Builds a compact index of the custom sections of a text from the tokens
+    of :func:`scan_sections` over the encoded text, as the text streams past:
+    a list of ``[name, start, end, hash]`` entries giving the byte range of
+    each section's content and a hash of that content.
+    """
+    def __init__(self):
+        self.index = []
+        self._offset = 0
+        self._open = None
+
+    def add(self, kind, text, name=None):
+        if kind == SECTION_START:
+            self._open = [name, self._offset + len(text), hashlib.sha1()]
+        elif kind == SECTION_CONTENT and self._open is not None:
+            self._open[2].update(text)
+        elif kind == SECTION_END and self._open is not None:
+            name, start, digest = self._open
+            self.index.append([name, start, self._offset, digest.hexdigest()])
+            self._open = None
+
+        self._offset += len(text)
+
+
+def read_sections(path, index):
+    """
+    Reads the sections described by ``index`` straight out of the file at
+    ``path``, memory mapping it where possible.  Returns a dictionary of
+    :class:`CustomSection` instances by name, or ``None`` if the file does
+    not match the index.
+    """
+    sections = dict()
+    if not index:
+        return sections
+
+    with open(path, 'rb') as fh:
+        if mmap is not None:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            read = lambda start, end: data[start:end]
+        else:
+            data = None
+            def read(start, end):
+                fh.seek(start)
+                return fh.read(end - start)
+
+        try:
+            for name, start, end, content_hash in index:
+                content = read(start, end)
+                if hash_text(content) != content_hash:
+                    return None
+                sections[name] = CustomSection(name, content)
+        finally:
+            if data is not None:
+                data.close()
+
+    return sections
+
+
+def _decoded(text):
+    if isinstance(text, str):
+        return text.decode('utf-8')
+    return text
+
+
+class CustomSectionsExtension(RendererExtension):
+    needs_full_text = False
+
+    def sections_iter(self, output):
+        for token in tokenize(output):
+            if isinstance(token, CustomSection):
+                yield token
 
     def get_existing_sections(self):
         """
         Pulls out the custom sections of an existing rendered template so they
-        can be reinserted in a new rendering.
+        can be reinserted in a new rendering.  When the build manifest has an
+        up to date index of them, an output without sections is not read at
+        all and one with sections only has those sections read.
         """
-        #import pdb; pdb.set_trace()
-        old_out = self.template.old_output
-        section_dict = dict() 
-        for section in self.sections_iter(old_out):
-            section_dict[section.name] = section
+        index = self.template.section_index()
+        if index is not None:
+            try:
+                sections = read_sections(self.template.render_path, index)
+            except (IOError, OSError, ValueError) as e:
+                sections = None
+            if sections is not None:
+                return sections
 
-        #self.cw.debug('Custom sections found: ' + str(section_dict.keys()))
+        # Otherwise scan the existing output a chunk at a time, only keeping
+        # the content of its sections
+        section_dict = dict()
+        current = None
+        try:
+            for kind, text, name in scan_sections(
+                    read_chunks(self.template.render_path)):
+                if kind == SECTION_START:
+                    current = (name, [])
+                elif kind == SECTION_CONTENT and current is not None:
+                    current[1].append(text)
+                elif kind == SECTION_END and current is not None:
+                    section_dict[current[0]] = CustomSection(current[0],
+                            ''.join(current[1]))
+                    current = None
+        except IOError as e:
+            cw.debug("Old output does not exist at render path: %s" %
+                    (self.template.render_path,))
 
         return section_dict
 
     def replace_sections(self, output):
         """
+        Stitches the content of the existing sections into the new output in
+        a single pass over it.  Sections that did not exist before keep the
+        content the template rendered for them.
         """
-        #import pdb; pdb.set_trace()
-        sections = []
-        for section in self.sections_iter(output):
-            sections.append(section)
+        return u''.join(self.replace_section_chunks([output]))
 
-            existing = self.existing_sections.get(section.name)
-
-            if existing is None:
-                #cw.debug("New custom section found: %s" % (section.name,))
-                continue
+    def replace_section_chunks(self, chunks):
+        """
+        The streaming version of :meth:`replace_sections`, which only holds
+        the rendered content of the section being replaced in memory
+        """
+        if not self.existing_sections:
+            for chunk in chunks:
+                yield chunk
+            return
 
-            output = existing.replace(output)
+        # The start delimiter and rendered content of a section that is being
+        # replaced, kept until its end shows that it really is a section
+        replacing = None
+        for kind, text, name in scan_sections(chunks):
+            if kind == SECTION_START and name in self.existing_sections:
+                replacing = (name, text, [])
+            elif replacing is None:
+                yield text
+            elif kind == SECTION_CONTENT:
+                replacing[2].append(text)
+            else:
+                yield replacing[1]
+                yield _decoded(self.existing_sections[replacing[0]].content)
+                yield text
+                replacing = None
 
-        #return self.add_comment(output, sections)
-        return output
+        if replacing is not None:
+            yield replacing[1]
+            for text in replacing[2]:
+                yield text
 
     def add_comment(self, output, sections):
         comment = (
@@ -94,6 +304,9 @@ class CustomSectionsExtension(RendererExtension):
     def post_render(self, output):
         return self.replace_sections(output)
 
+    def post_render_chunks(self, chunks):
+        return self.replace_section_chunks(chunks)
+
 
 # Post-render steps
 # 1. Go through each of the sections found in the new template output
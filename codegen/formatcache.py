@@ -0,0 +1,95 @@
+import os
+import threading
+
+from .consolewriter import cw
+from .util import atomic_write, hash_text
+
+"""
+A content addressed, on-disk cache of code formatter results
+"""
+
+DEFAULT_MAX_MEGABYTES = 256
+
+
+class FormatCache(object):
+    """
+    Formatted output stored under a hash of the formatter (its command and
+    configuration file) and the unformatted text, so that text which has
+    been formatted before is never sent to the formatter again.
+
+    Entries are touched when they are used and the least recently used ones
+    are removed whenever the cache grows past ``max_bytes``.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_MEGABYTES * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    def key(self, beautifier, text):
+        return hash_text('%s\0%s' % (beautifier.fingerprint(), text))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as fh:
+                result = fh.read()
+            os.utime(path, None)
+        except (IOError, OSError) as e:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            atomic_write(path, result)
+        except (IOError, OSError) as e:
+            cw.warning("Cannot write to format cache %s: %s" %
+                    (self.cache_dir, e))
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._current_size()
+            else:
+                self._size += len(result)
+
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    file_stat = os.stat(path)
+                except OSError as e:
+                    continue
+                yield file_stat.st_mtime, file_stat.st_size, path
+
+    def _current_size(self):
+        return sum(size for mtime, size, path in self._entries())
+
+    def _evict(self):
+        # Trim to below the limit so that eviction does not run on every put
+        target = self.max_bytes * 0.9
+        for mtime, size, path in sorted(self._entries()):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError as e:
+                pass
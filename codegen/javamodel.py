@@ -0,0 +1,35 @@
+from java.util import ArrayList, HashMap, List
+
+"""
+Conversion of models into native Java collections.  StringTemplate reads
+``java.util.Map`` and ``java.util.List`` with its own built in adaptors, so a
+converted model is rendered without calling back into python for every
+property lookup.
+"""
+
+def to_java(data):
+    """
+    Returns a copy of ``data`` with every dictionary converted into a
+    ``java.util.HashMap`` and every list or tuple into a
+    ``java.util.ArrayList``.  Everything else is left for Jython to coerce.
+    """
+    if isinstance(data, dict):
+        converted = HashMap(max(16, len(data) * 2))
+        for k, v in data.items():
+            converted.put(k, to_java(v))
+        return converted
+    elif isinstance(data, (list, tuple)):
+        converted = ArrayList(len(data))
+        for v in data:
+            converted.add(to_java(v))
+        return converted
+
+    return data
+
+def java_child(node, key):
+    """
+    Looks up one element of a dotted model path in a converted model
+    """
+    if isinstance(node, List):
+        return node.get(int(key))
+    return node.get(key)
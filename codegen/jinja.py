@@ -0,0 +1,280 @@
+import os
+import threading
+
+try:
+    import jinja2
+    from jinja2 import meta
+except ImportError:
+    jinja2 = None
+
+from .exceptions import (
+        CodegenError,
+        InvalidConfigurationError,
+        TemplateCompilationError,
+        TemplateRenderError,
+    )
+from .stats import build_stats
+from .templates import Template
+from .util import coalesce_chunks, fingerprint, hash_file
+
+"""
+The Jinja2 template type, which runs under CPython without a JVM
+"""
+
+def _check_jinja():
+    if jinja2 is None:
+        raise InvalidConfigurationError("The jinja2 package is needed to "
+                "render jinja templates")
+
+
+class JinjaTemplate(Template):
+    """
+    A Jinja2 template wrapper.  The template ``name`` is read from
+    ``name.jinja`` in the template directory, which is also where it can
+    include, import or extend other templates from.
+    """
+    template_type = 'jinja'
+
+    FILE_EXTENSION = '.jinja'
+
+    def __init__(self, name, template_path, *args, **kwargs):
+        """
+        :param name: The name of the template
+        :param template_path: The file the template is read from
+        :param cache_dir: The directory compiled templates are cached in
+        """
+        _check_jinja()
+        self.name = name
+        self.template_path = template_path
+        self.cache_dir = kwargs.pop('cache_dir', None)
+        super(JinjaTemplate, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return self.__unicode__().encode('utf-8')
+
+    def __unicode__(self):
+        return "%s (%s)" % (self.name, self.template_path)
+
+    @classmethod
+    def from_config(cls, name, template_dir, *args, **kwargs):
+        template_path = os.path.join(template_dir, name + cls.FILE_EXTENSION)
+        return cls(name, template_path, *args, **kwargs)
+
+    @classmethod
+    def options(cls, config):
+        return {'cache_dir': os.path.join(config['base_dir'],
+                                          config['cache_dir'], 'jinja')}
+
+    @classmethod
+    def render_path_renderer(cls, render_path):
+        _check_jinja()
+        compiled = jinja2.Environment().from_string(render_path)
+        return compiled.render
+
+    def template_files(self):
+        """
+        The absolute paths of the template file and of every template it
+        includes, imports or extends
+        """
+        return environment_cache.template_files(self._environment,
+                                                self.template_path)
+
+    def dependencies(self):
+        deps = super(JinjaTemplate, self).dependencies()
+        deps.update(self.template_files())
+        return deps
+
+    def build_inputs(self):
+        inputs = super(JinjaTemplate, self).build_inputs()
+        template_dir = os.path.dirname(os.path.abspath(self.template_path))
+        inputs['template'] = fingerprint(dict(
+                (os.path.relpath(path, template_dir), hash_file(path))
+                for path in self.template_files()))
+        return inputs
+
+    @property
+    def _environment(self):
+        return environment_cache.get(os.path.dirname(self.template_path),
+                                     self.cache_dir)
+
+    @property
+    def _jinja_template(self):
+        if not hasattr(self, '_inst'):
+            try:
+                with build_stats.phase('template compile'):
+                    self._inst = self._environment.get_template(
+                            os.path.basename(self.template_path))
+            except jinja2.TemplateNotFound as e:
+                raise InvalidConfigurationError(
+                    "Cannot open jinja template file %s" %
+                    (self.template_path,))
+            except jinja2.TemplateSyntaxError as e:
+                raise TemplateCompilationError("%s:%s: %s" %
+                        (e.filename, e.lineno, e.message))
+
+        return self._inst
+
+    def model_keys(self):
+        return environment_cache.model_keys(self._environment,
+                                            self.template_path)
+
+    def _context(self):
+        keys = self.model_keys()
+        if keys is None:
+            return dict(self.model.items())
+
+        return dict((k, self.model[k]) for k in keys if k in self.model)
+
+    def render(self):
+        with build_stats.phase('model injection'):
+            context = self._context()
+
+        with build_stats.phase('render'):
+            try:
+                return self._jinja_template.render(context)
+            except CodegenError:
+                raise
+            except Exception as e:
+                raise self._render_error(e)
+
+    def render_chunks(self, spool_dir=None):
+        with build_stats.phase('model injection'):
+            context = self._context()
+
+        # Jinja renders a (small) piece at a time as the pieces are asked for
+        pieces = self._jinja_template.generate(context)
+        try:
+            for chunk in build_stats.timed('render', coalesce_chunks(pieces)):
+                yield chunk
+        except CodegenError:
+            raise
+        except Exception as e:
+            raise self._render_error(e)
+
+    def _render_error(self, e):
+        # Errors raised by the template code itself, such as a TypeError from
+        # a model value, are reported the same way as Jinja's own
+        if isinstance(e, jinja2.TemplateError):
+            return TemplateRenderError("%s: %s" % (self, e))
+        return TemplateRenderError("%s: %s: %s" %
+                (self, e.__class__.__name__, e))
+
+
+class JinjaEnvironmentCache(object):
+    """
+    The Jinja2 environments of each template directory.  An environment keeps
+    the templates it has compiled in memory, reloading them when they change,
+    and writes their bytecode to the cache directory so that later processes
+    do not have to compile them again.
+    """
+    def __init__(self):
+        self._environments = {}
+        self._scans = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_dir, cache_dir=None):
+        key = (os.path.abspath(template_dir), cache_dir)
+        with self._lock:
+            if key not in self._environments:
+                self._environments[key] = self._create(template_dir,
+                                                       cache_dir)
+            return self._environments[key]
+
+    def _create(self, template_dir, cache_dir):
+        bytecode_cache = None
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+
+        return jinja2.Environment(
+                loader=jinja2.FileSystemLoader(template_dir),
+                bytecode_cache=bytecode_cache,
+                keep_trailing_newline=True,
+                auto_reload=True)
+
+    def _scan(self, env, template_path):
+        """
+        Returns the top level names the template at ``template_path`` reads
+        and the names of the templates it references, which are ``None``
+        where the name is only known when rendering
+        """
+        path = os.path.abspath(template_path)
+        try:
+            key = (path, os.stat(path).st_mtime)
+        except OSError as e:
+            raise InvalidConfigurationError(
+                "Cannot open jinja template file %s" % (template_path,))
+
+        with self._lock:
+            if key in self._scans:
+                return self._scans[key]
+
+        with open(path, 'r') as fh:
+            source = fh.read().decode('utf-8')
+        try:
+            ast = env.parse(source)
+        except jinja2.TemplateSyntaxError as e:
+            raise TemplateCompilationError("%s:%s: %s" %
+                    (template_path, e.lineno, e.message))
+
+        scan = (sorted(meta.find_undeclared_variables(ast)),
+                list(meta.find_referenced_templates(ast)))
+        with self._lock:
+            self._scans[key] = scan
+        return scan
+
+    def model_keys(self, env, template_path):
+        """
+        The top level names the template at ``template_path`` reads, or
+        ``None`` if it can read any of them
+        """
+        keys, referenced = self._scan(env, template_path)
+
+        # Included, imported and parent templates can read any key
+        if referenced:
+            return None
+        return keys
+
+    def template_files(self, env, template_path):
+        """
+        The absolute paths of the template at ``template_path`` and of the
+        templates it references, directly or through other templates.  A
+        template whose name is only known when rendering could be any file
+        in the template directory.
+        """
+        template_dir = os.path.dirname(os.path.abspath(template_path))
+        found = set()
+        pending = [os.path.abspath(template_path)]
+        while pending:
+            path = pending.pop()
+            if path in found:
+                continue
+            found.add(path)
+
+            for name in self._scan(env, path)[1]:
+                if name is None:
+                    return self._all_files(template_dir)
+                ref_path = os.path.join(template_dir, *name.split('/'))
+                # A missing template fails the render instead
+                if os.path.isfile(ref_path):
+                    pending.append(ref_path)
+
+        return sorted(found)
+
+    @staticmethod
+    def _all_files(template_dir):
+        paths = []
+        for dir_path, dir_names, file_names in os.walk(template_dir):
+            dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+            paths.extend(os.path.join(dir_path, f) for f in file_names
+                         if not f.startswith('.'))
+        return sorted(paths)
+
+    def clear(self):
+        self._environments.clear()
+        self._scans.clear()
+
+
+# Environments are shared by every template rendered in the process
+environment_cache = JinjaEnvironmentCache()
@@ -0,0 +1,66 @@
+import sys
+import traceback
+
+from .config import (
+        CommandLineConfig,
+        FileConfig,
+        DefaultConfig,
+        MergedConfig,
+    )
+from .exceptions import CodegenError
+from .renderer import Builder
+from .stats import build_stats
+
+"""
+The command line entry point
+"""
+
+def run(argv=None):
+    """
+    Runs codegen with the given command line arguments and returns the exit
+    status.
+    """
+    cl_cfg = None
+    try:
+        cl_cfg = CommandLineConfig(argv)
+        if cl_cfg['server']:
+            from .server import serve
+            return serve(cl_cfg['socket'])
+
+        build_stats.reset(enabled=bool(cl_cfg['stats'] or
+                                       cl_cfg['stats_json']))
+
+        def load_config():
+            with build_stats.phase('config load'):
+                file_cfg = FileConfig(cl_cfg['config_file'])
+                return MergedConfig(cl_cfg, file_cfg, DefaultConfig())
+
+        if cl_cfg['watch']:
+            from .watch import Watcher
+            try:
+                Watcher(cl_cfg['config_file'], load_config,
+                        cl_cfg['watch_interval']).watch()
+            except KeyboardInterrupt:
+                pass
+            return 0
+
+        if cl_cfg['merge_shards']:
+            from .shard import merge_shards
+            merge_shards(load_config()['base_dir'], cl_cfg['to_render'])
+            return 0
+
+        builder = Builder(load_config())
+        if cl_cfg['list']:
+            builder.list_templates()
+        else:
+            builder.render_templates()
+
+        return 0
+    except CodegenError as e:
+        if cl_cfg is not None and cl_cfg['verbose']:
+            msg = traceback.format_exc()
+        else:
+            msg = str(e)
+
+        sys.stderr.write("Error: %s\n" % (msg,))
+        return 1
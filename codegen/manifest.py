@@ -0,0 +1,180 @@
+import json
+import os
+
+from . import __version__
+from .consolewriter import cw
+from .exceptions import CodegenError
+from .util import atomic_write, hash_file
+
+"""
+The build manifest, which records what every output was rendered from so
+that templates whose inputs have not changed can be skipped.
+"""
+
+MANIFEST_FILENAME = '.codegen-manifest'
+
+
+class BuildManifest(object):
+    """
+    A record, stored as JSON in ``path``, of the inputs each output was last
+    rendered from.  Each entry is keyed by render path and holds the hash of
+    the group file, the model (sub)tree and the configuration entry the
+    output came from, the hash of the whole model source, the codegen
+    version that rendered it and the hash, size and modification time of
+    the output that was written, along with an index of the custom sections
+    in it so they can be read back without scanning the whole file.
+
+    The manifest also keeps the model and render paths each ``forModelPaths``
+    template expanded to, so they can be reused while the model and the
+    configuration entry stay the same.
+    """
+    def __init__(self, path):
+        self.path = path
+        manifest = self._load()
+        self.entries = manifest.get('outputs', {})
+        self.expansions = {}
+        if manifest.get('version') == __version__:
+            self.expansions = manifest.get('expansions', {})
+
+    @classmethod
+    def for_config(cls, config):
+        # Each shard of a sharded build keeps its own manifest until they are
+        # merged
+        if config['shard']:
+            from .shard import shard_manifest_path
+            return cls(shard_manifest_path(config['base_dir'], config['shard']))
+
+        return cls(os.path.join(config['base_dir'], MANIFEST_FILENAME))
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                manifest = json.load(fh)
+        except IOError as e:
+            return {}
+        except ValueError as e:
+            cw.warning("Ignoring unreadable build manifest %s: %s" %
+                    (self.path, e))
+            return {}
+
+        return manifest
+
+    @staticmethod
+    def _key(template):
+        return os.path.normpath(template.render_path)
+
+    def get(self, template):
+        return self.entries.get(self._key(template))
+
+    def is_current(self, template):
+        """
+        Returns ``True`` if the output of ``template`` was rendered by this
+        version of codegen from the same inputs it has now, and has not been
+        changed on disk since.
+        """
+        entry = self.get(template)
+        if entry is None or entry.get('version') != __version__:
+            return False
+
+        inputs = template.build_inputs()
+        for key, value in inputs.items():
+            if entry.get(key) != value:
+                return False
+
+        return (self._model_unchanged(template, entry) and
+                self._output_unchanged(template.render_path, entry))
+
+    def _model_unchanged(self, template, entry):
+        # Checking the whole source first avoids parsing the model at all
+        # when nothing in it has changed.
+        source = template.model_source_fingerprint()
+        if source is not None and source == entry.get('model_source'):
+            return True
+
+        return template.model_fingerprint() == entry.get('model')
+
+    def _output_unchanged(self, path, entry):
+        try:
+            out_stat = os.stat(path)
+        except OSError as e:
+            return False
+
+        if (out_stat.st_size == entry.get('size') and
+                out_stat.st_mtime == entry.get('mtime')):
+            return True
+
+        return hash_file(path) == entry.get('output')
+
+    def record(self, template, output_hash, sections=None):
+        """
+        Records the inputs of ``template`` and the hash of the output that was
+        just written to its render path, along with the index of its custom
+        sections from :class:`SectionIndexer`.
+        """
+        out_stat = os.stat(template.render_path)
+
+        entry = template.build_inputs()
+        entry.update({
+            'model': template.model_fingerprint(),
+            'model_source': template.model_source_fingerprint(),
+            'version': __version__,
+            'output': output_hash,
+            'size': out_stat.st_size,
+            'mtime': out_stat.st_mtime,
+            'sections': sections,
+        })
+        self.entries[self._key(template)] = entry
+
+    def expansion(self, key, model_source):
+        """
+        Returns the list of ``(model_path, render_path)`` pairs recorded for
+        the fan-out configuration entry identified by ``key``, if they were
+        expanded from a model source with the hash ``model_source``,
+        otherwise ``None``
+        """
+        expansion = self.expansions.get(key)
+        if (expansion is None or model_source is None or
+                expansion.get('model_source') != model_source):
+            return None
+
+        return [tuple(p) for p in expansion['paths']]
+
+    def record_expansion(self, key, model_source, paths):
+        self.expansions[key] = {
+            'model_source': model_source,
+            'paths': paths,
+        }
+
+    def retain_expansions(self, keys):
+        """
+        Forgets the expansions of every configuration entry but ``keys``
+        """
+        keep = set(keys)
+        for key in list(self.expansions):
+            if key not in keep:
+                del self.expansions[key]
+
+    def retain(self, templates, among=None):
+        """
+        Forgets the entries of every render path but those of ``templates``,
+        or only of those of the templates ``among`` if given
+        """
+        keep = set(self._key(t) for t in templates)
+        if among is None:
+            candidates = list(self.entries)
+        else:
+            candidates = [self._key(t) for t in among]
+
+        for key in candidates:
+            if key not in keep:
+                self.entries.pop(key, None)
+
+    def save(self):
+        try:
+            atomic_write(self.path, json.dumps(
+                    {'version': __version__, 'outputs': self.entries,
+                     'expansions': self.expansions},
+                    sort_keys=True, indent=1))
+        except (IOError, OSError) as e:
+            raise CodegenError("Problem writing build manifest (%s): %s" %
+                    (self.path, e))
@@ -1,20 +1,153 @@
-from .exceptions import InvalidConfigurationError
-from .util import load_yaml
+import json
+import os
+import re
+import threading
+from stat import ST_MTIME
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from yaml import YAMLError
+
+from .consolewriter import cw
+from .exceptions import InvalidConfigurationError, ModelPathError
+from .stats import build_stats
+from .util import (
+        atomic_write,
+        fingerprint,
+        hash_file,
+        hash_text,
+        load_yaml,
+    )
 
 """
 Everything related to template models
 """
 
-class TemplateModel(object):
+class ModelView(object):
+    """
+    Read-only dictionary access to some part of a model, along with stable
+    fingerprints of the data it covers.  Subclasses provide ``data``.
+    """
+    @property
+    def data(self):
+        raise NotImplementedError("You should implement the data property in "
+                "your ModelView subclass")
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def items(self):
+        return self.data.items()
+
+    def key_fingerprint(self, key):
+        """
+        A hash of the value of a single key of this view
+        """
+        if not hasattr(self, '_key_fingerprints'):
+            self._key_fingerprints = {}
+        if key not in self._key_fingerprints:
+            self._key_fingerprints[key] = fingerprint(self.data.get(key))
+
+        return self._key_fingerprints[key]
+
+    @property
+    def source_paths(self):
+        """
+        The files the model data is loaded from
+        """
+        return []
+
+    @property
+    def java_data(self):
+        """
+        The data of this view converted into native Java collections, see
+        :func:`codegen.javamodel.to_java`.  Only available under Jython.
+        """
+        raise NotImplementedError("You should implement the java_data "
+                "property in your ModelView subclass")
+
+    def fingerprint_keys(self, keys):
+        """
+        A hash of only the given keys of this view, for templates that cannot
+        read anything else.
+        """
+        return fingerprint(sorted((k, self.key_fingerprint(k))
+                                  for k in keys if k in self))
+
+
+class TemplateModel(ModelView):
     def __init__(self, source):
         """
         :param source: An instance of a subclass of :class:`ModelSource` that
          wraps the actual data for the model.
         """
         self.source = source
+        self._path_fingerprints = {}
+        self._path_indexes = {}
+        self._java_paths = {}
+
+    @classmethod
+    def from_file(cls, file_path, registry=None):
+        """
+        Returns the model for ``file_path`` from ``registry`` (the shared
+        module registry by default), parsing the file only if it has not been
+        seen before or has changed since it was last parsed.  ``file_path``
+        can also be a directory or list of fragment files, see
+        :class:`FragmentModelSource`.
+        """
+        if registry is None:
+            registry = model_registry
+        return registry.get(file_path)
+
+    @property
+    def data(self):
+        return self.source.data
+
+    # Top level keys go through the source so that sources made of several
+    # fragments only have to load the ones that are used
 
     def __getitem__(self, key):
-        return self.source.data[key]
+        if key not in self:
+            raise KeyError(key)
+        return self.source.get(key)
+
+    def __contains__(self, key):
+        return key in self.source.keys()
+
+    def __iter__(self):
+        return iter(self.source.keys())
+
+    def get(self, key, default=None):
+        return self.source.get(key, default)
+
+    def keys(self):
+        return self.source.keys()
+
+    def items(self):
+        return [(k, self.source.get(k)) for k in self.source.keys()]
+
+    def key_fingerprint(self, key):
+        if not hasattr(self, '_key_fingerprints'):
+            self._key_fingerprints = {}
+        if key not in self._key_fingerprints:
+            self._key_fingerprints[key] = self.source.key_fingerprint(key)
+
+        return self._key_fingerprints[key]
 
     @property
     def last_modified(self):
@@ -23,19 +156,418 @@ class TemplateModel(object):
         except AttributeError:
             return None
 
+    @property
+    def fingerprint(self):
+        """
+        A hash of the whole model.  File based sources can provide this
+        without the model having to be parsed.
+        """
+        if not hasattr(self, '_fingerprint'):
+            try:
+                self._fingerprint = self.source.fingerprint
+            except AttributeError:
+                self._fingerprint = fingerprint(self.source.data)
+
+        return self._fingerprint
+
+    source_fingerprint = fingerprint
+
+    @property
+    def source_paths(self):
+        try:
+            return [os.path.abspath(p) for p in self.source.file_paths]
+        except AttributeError:
+            pass
+        try:
+            return [os.path.abspath(self.source.file_path)]
+        except AttributeError:
+            return []
+
+    def path_index(self, key):
+        """
+        The :class:`PathIndex` of the value of the top level ``key``, built
+        the first time it is needed.  Each key has an index of its own so
+        that sources made of several fragments only have to load the ones
+        that paths lead into.
+        """
+        if key not in self._path_indexes:
+            with _build_lock:
+                if key not in self._path_indexes:
+                    self._path_indexes[key] = PathIndex(self.source.get(key),
+                                                        key)
+
+        return self._path_indexes[key]
+
     def get_path(self, path):
-        paths = filter(None, path.split('.').reverse())
+        paths = filter(None, path.split('.'))
+        if not paths:
+            return self.source.data
+        if paths[0] not in self:
+            raise ModelPathError("Cannot resolve path element '%s' in path "
+                    "'%s'" % (paths[0], path))
+
+        node = self.path_index(paths[0]).get(path)
+        if node is not None:
+            return node
 
-        component = self.source.data
+        # Leaf values are not in the index
+        paths.reverse()
+
+        component = self.source.get(paths.pop())
         try:
             while len(paths) > 0:
-                component = component[paths.pop()]
-        except KeyError as e:
+                component = _child(component, paths.pop())
+        except (KeyError, IndexError, ValueError, TypeError) as e:
             raise ModelPathError("Cannot resolve path element '%s' in path '%s'"
                     % (e.message, path))
 
         return component
 
+    def _children(self, path):
+        if not path:
+            return sorted(str(k) for k in self.keys())
+        return self.path_index(path.split('.', 1)[0]).children(path)
+
+    def _is_node(self, path):
+        return self.path_index(path.split('.', 1)[0]).get(path) is not None
+
+    @property
+    def java_data(self):
+        if not hasattr(self, '_java_data'):
+            with _build_lock:
+                if not hasattr(self, '_java_data'):
+                    from .javamodel import to_java
+                    self._java_data = to_java(self.source.data)
+
+        return self._java_data
+
+    def java_path(self, path):
+        """
+        The converted subtree at ``path``, taken from the converted model so
+        that every subtree is only converted once
+        """
+        if path not in self._java_paths:
+            from .javamodel import java_child
+            node = self.java_data
+            for key in filter(None, path.split('.')):
+                node = java_child(node, key)
+            self._java_paths[path] = node
+
+        return self._java_paths[path]
+
+    def resolve(self, selector):
+        """
+        Returns the concrete dotted paths in the model that ``selector``
+        matches.  A path element of ``*`` matches every key of a map (in
+        sorted order) or every item of a list, and ``[start:stop]`` or
+        ``[i]`` after an element picks a slice or a single item of the keys
+        or items it matches, e.g. ``tables.*``, ``modules.*.entities.*`` or
+        ``tables[0:100]``.  List items are addressed by their index.
+
+        :raises ModelPathError: If nothing in the model matches ``selector``
+        """
+        if '*' not in selector and '[' not in selector:
+            self.get_path(selector)
+            return [selector]
+
+        paths = resolve_selector(selector, self._children, self._is_node)
+        if not paths:
+            raise ModelPathError("No paths in the model match '%s'" % selector)
+        return paths
+
+    def path_fingerprint(self, path):
+        """
+        A stable hash of the subtree of the model at ``path``
+        """
+        if path not in self._path_fingerprints:
+            self._path_fingerprints[path] = fingerprint(self.get_path(path))
+
+        return self._path_fingerprints[path]
+
+    def view(self, path):
+        """
+        Returns a :class:`SubModel` for the subtree at ``path``
+        """
+        return SubModel(self, path)
+
+    def query(self, sql):
+        """
+        Yields a :class:`RowModel` for each row ``sql`` returns from the
+        source of this model, which must be a database
+        """
+        if not hasattr(self.source, 'query'):
+            raise InvalidConfigurationError("Only database models can be "
+                    "queried, not %s" % (getattr(self.source, 'file_path',
+                                                 self.source),))
+
+        for row in self.source.query(sql):
+            yield RowModel(self, row)
+
+
+class PathIndex(object):
+    """
+    An index of every map and list in a model by its concrete dotted path,
+    built in one walk of the model so that resolving selectors never has to
+    walk it again.
+    """
+
+    def __init__(self, data, path=''):
+        """
+        :param data: The map or list to index
+        :param path: The path of ``data`` in the whole model
+        """
+        self.nodes = {}
+        self._children = {}
+
+        stack = [(path, data)]
+        while stack:
+            path, node = stack.pop()
+            if isinstance(node, dict):
+                items = node.items()
+            elif isinstance(node, list):
+                items = enumerate(node)
+            else:
+                continue
+            self.nodes[path] = node
+
+            for key, child in items:
+                if isinstance(child, (dict, list)):
+                    stack.append((_join(path, key), child))
+
+    def get(self, path):
+        return self.nodes.get(path)
+
+    def children(self, path):
+        """
+        The keys of a map, in sorted order, or the indexes of a list
+        """
+        if path not in self._children:
+            node = self.nodes.get(path)
+            if isinstance(node, dict):
+                keys = sorted(str(k) for k in node.keys())
+            elif isinstance(node, list):
+                keys = [str(i) for i in range(len(node))]
+            else:
+                keys = []
+            self._children[path] = keys
+
+        return self._children[path]
+
+    def resolve(self, selector):
+        return resolve_selector(selector, self.children,
+                                lambda path: path in self.nodes)
+
+
+_SEGMENT_REGEX = re.compile(r'^(?P<key>[^\[\]]*)'
+        r'(?:\[(?P<start>-?\d*)(?P<colon>:)?(?P<stop>-?\d*)\])?$')
+
+def resolve_selector(selector, children, is_node):
+    """
+    Returns the concrete paths of the maps and lists ``selector`` matches,
+    see :meth:`TemplateModel.resolve`
+
+    :param children: A function returning the keys of the map, or indexes of
+     the list, at a path
+    :param is_node: A function telling whether a path is a map or list
+    """
+    paths = ['']
+    for segment in filter(None, selector.split('.')):
+        match = _SEGMENT_REGEX.match(segment)
+        if match is None:
+            raise ModelPathError("Invalid path element '%s' in '%s'" %
+                    (segment, selector))
+
+        key = match.group('key')
+        if key == '*':
+            paths = [_join(p, k) for p in paths for k in children(p)]
+        elif key:
+            paths = [_join(p, key) for p in paths if key in children(p)]
+
+        if match.group('start') is not None:
+            paths = [_join(p, k) for p in paths
+                     for k in _slice(children(p), match)]
+
+    return [p for p in paths if is_node(p)]
+
+def _slice(keys, match):
+    start = int(match.group('start')) if match.group('start') else None
+    if not match.group('colon'):
+        try:
+            return [keys[start or 0]]
+        except IndexError:
+            return []
+
+    stop = int(match.group('stop')) if match.group('stop') else None
+    return keys[start:stop]
+
+def _join(path, key):
+    return '%s.%s' % (path, key) if path else str(key)
+
+def _child(node, key):
+    if isinstance(node, list):
+        return node[int(key)]
+    return node[key]
+
+# Guards the lazily built path index and Java conversion of models
+_build_lock = threading.Lock()
+
+
+class SubModel(ModelView):
+    """
+    A read-only view of the subtree of a :class:`TemplateModel` at a dotted
+    path.  These are what templates fanned out with ``forModelPaths`` are
+    rendered with, so that each output is fingerprinted by its own subtree.
+    """
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+
+    @property
+    def data(self):
+        return self.model.get_path(self.path)
+
+    @property
+    def fingerprint(self):
+        return self.model.path_fingerprint(self.path)
+
+    @property
+    def source_fingerprint(self):
+        return self.model.source_fingerprint
+
+    @property
+    def source_paths(self):
+        return self.model.source_paths
+
+    @property
+    def java_data(self):
+        return self.model.java_path(self.path)
+
+
+class RowModel(ModelView):
+    """
+    A single row returned by a query against the source of a
+    :class:`TemplateModel`.  These are what templates fanned out with
+    ``forQuery`` are rendered with, so that each output is fingerprinted by
+    its own row.
+    """
+    def __init__(self, model, row):
+        self.model = model
+        self.row = row
+
+    @property
+    def data(self):
+        return self.row
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.row)
+
+    @property
+    def source_fingerprint(self):
+        return self.model.source_fingerprint
+
+    @property
+    def source_paths(self):
+        return self.model.source_paths
+
+    @property
+    def java_data(self):
+        if not hasattr(self, '_java_data'):
+            from .javamodel import to_java
+            self._java_data = to_java(self.row)
+
+        return self._java_data
+
+
+class ModelRegistry(object):
+    """
+    A cache of file based models that is shared by every template in a build.
+    Models are keyed by the resolved path of their file and are only parsed
+    again when the size or modification time of that file changes.
+
+    The :class:`TemplateModel` instances that are handed out are shared
+    between all of the templates that use the same file, so they must be
+    treated as read-only.
+    """
+    def __init__(self, snapshots=None):
+        """
+        :param snapshots: A :class:`ModelSnapshotCache` to keep parsed data in
+        """
+        self._models = {}
+        self._lock = threading.Lock()
+        self.snapshots = snapshots
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path):
+        with self._lock:
+            return self._get(file_path)
+
+    def _get(self, file_path):
+        if file_path is None or not file_path:
+            raise InvalidConfigurationError(
+                "Cannot load empty file path for model")
+
+        if isinstance(file_path, (list, tuple)) or os.path.isdir(file_path):
+            return self._get_fragments(file_path)
+
+        real_path = os.path.realpath(file_path)
+        try:
+            file_stat = os.stat(real_path)
+        except OSError as e:
+            raise InvalidConfigurationError("The given model file cannot be "
+                    "opened: %s" % (file_path,))
+
+        key = (file_stat.st_mtime, file_stat.st_size)
+        cached = self._models.get(real_path)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        source = FileModelSource.for_path(real_path)
+        source.snapshots = self.snapshots
+        model = TemplateModel(source)
+        self._models[real_path] = (key, model)
+
+        return model
+
+    def _get_fragments(self, file_path):
+        """
+        Returns the model made of the fragment files in the directory
+        ``file_path``, or in the list ``file_path``.  The fragments themselves
+        are loaded and cached individually when they are first read.
+        """
+        if isinstance(file_path, (list, tuple)):
+            paths = file_path
+        else:
+            paths = FragmentModelSource.fragment_files(file_path)
+
+        real_paths = [os.path.realpath(p) for p in paths]
+        try:
+            key = tuple((p, os.stat(p).st_mtime, os.stat(p).st_size)
+                        for p in real_paths)
+        except OSError as e:
+            raise InvalidConfigurationError("The given model file cannot be "
+                    "opened: %s" % (e.filename,))
+
+        cache_key = ('fragments',) + tuple(real_paths)
+        cached = self._models.get(cache_key)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        model = TemplateModel(FragmentModelSource(real_paths, self))
+        self._models[cache_key] = (key, model)
+
+        return model
+
+    def clear(self):
+        self._models.clear()
+        self.hits = 0
+        self.misses = 0
+
 
 class ModelSource(object):
     @property
@@ -47,6 +579,18 @@ class ModelSource(object):
         raise NotImplementedError("You should implement the data property in "
                 "your ModelSource subclass")
 
+    def keys(self):
+        return self.data.keys()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def key_fingerprint(self, key):
+        """
+        A hash of the value of the top level ``key``
+        """
+        return fingerprint(self.data.get(key))
+
 
 class DictModelSource(ModelSource):
     """
@@ -61,7 +605,7 @@ class DictModelSource(ModelSource):
 
     @property
     def data(self):
-        return _data
+        return self._data
 
     @property
     def last_modified(self):
@@ -69,32 +613,316 @@ class DictModelSource(ModelSource):
 
 
 class FileModelSource(ModelSource):
+    """
+    A model that is parsed from a file the first time its data is needed.
+    Subclasses implement :meth:`_parse` for their file format.
+    """
+    # The ModelSnapshotCache parsed data is stored in and loaded from, if any
+    snapshots = None
+
     def __init__(self, file_path):
         self.file_path = file_path
+        self._load_lock = threading.Lock()
 
         if file_path is None or not file_path:
             raise InvalidConfigurationError(
                 "Cannot load empty file path for model")
 
+    @classmethod
+    def for_path(cls, file_path):
+        """
+        Returns a source for ``file_path`` of the class that handles its
+        extension, treating anything unknown as YAML
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+        return ext_to_source.get(ext, YAMLFileModelSource)(file_path)
+
     @property
     def last_modified(self):
         return os.stat(self.file_path)[ST_MTIME]
+
+    @property
+    def fingerprint(self):
+        return hash_file(self.file_path)
+
+    @property
+    def data(self):
+        if not hasattr(self, '_data'):
+            with self._load_lock:
+                if not hasattr(self, '_data'):
+                    self._data = self._load()
+
+        return self._data
+
+    def _load(self):
+        with build_stats.phase('model load'):
+            return self._load_data()
+
+    def _load_data(self):
+        if self.snapshots is not None:
+            found, data = self.snapshots.load(self)
+            if found:
+                return data
+
+        try:
+            data = self._parse()
+        except IOError as e:
+            raise InvalidConfigurationError("The given model file cannot be "
+                    "opened: %s" % (self.file_path,))
+
+        if self.snapshots is not None:
+            self.snapshots.store(self, data)
+
+        return data
+
+    def _parse(self):
+        raise NotImplementedError("You should implement _parse in your "
+                "FileModelSource subclass")
     
 
 class YAMLFileModelSource(FileModelSource):
     """
     A model that comes from a yaml file.
     """
-    @property
-    def data(self):
-        if not hasattr(self, '_data'):
+    def _parse(self):
+        try:
+            return load_yaml(self.file_path)
+        except YAMLError as e:
+            raise InvalidConfigurationError(
+                    "Error parsing model yaml file (%s): %s" % (self.file_path, e))
+
+
+class JSONFileModelSource(FileModelSource):
+    """
+    A model that comes from a JSON file.
+    """
+    def _parse(self):
+        try:
+            with open(self.file_path, 'r') as fh:
+                return json.load(fh)
+        except ValueError as e:
+            raise InvalidConfigurationError(
+                    "Error parsing model JSON file (%s): %s" % (self.file_path, e))
+
+
+class MsgpackFileModelSource(FileModelSource):
+    """
+    A model that comes from a msgpack file.  Needs the msgpack package.
+    """
+    def _parse(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise InvalidConfigurationError("The msgpack package is needed to "
+                    "load the model file %s" % (self.file_path,))
+
+        try:
+            with open(self.file_path, 'rb') as fh:
+                return msgpack.unpackb(fh.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise InvalidConfigurationError(
+                    "Error parsing model msgpack file (%s): %s" %
+                    (self.file_path, e))
+
+
+class SqliteModelSource(FileModelSource):
+    """
+    A model that lives in a SQLite database.  As a whole it is a map of each
+    table name to the list of its rows, but templates can instead fan out
+    over the rows of a query with ``forQuery``, which are streamed from a
+    cursor a batch at a time rather than loaded all at once.
+    """
+    # The number of rows fetched from the cursor at a time
+    batch_size = 500
+
+    def _connect(self):
+        """
+        Returns a connection to the database and the exception class its
+        errors are raised as
+        """
+        # Connecting would otherwise create an empty database
+        if not os.path.isfile(self.file_path):
+            raise IOError("No such file: %s" % (self.file_path,))
+
+        try:
+            import sqlite3
+        except ImportError:
+            # Jython has no sqlite3 module, but can use the SQLite JDBC driver
+            from com.ziclix.python.sql import zxJDBC
+            return (zxJDBC.connect('jdbc:sqlite:' + self.file_path, None,
+                                   None, 'org.sqlite.JDBC'),
+                    zxJDBC.Error)
+
+        # Fan-out templates are expanded by whichever render thread needs the
+        # next one, but never by more than one at a time
+        return (sqlite3.connect(self.file_path, check_same_thread=False),
+                sqlite3.Error)
+
+    def _parse(self):
+        tables = self.query("SELECT name FROM sqlite_master WHERE "
+                            "type = 'table' AND name NOT LIKE 'sqlite_%'")
+        return dict((t['name'], list(self.query('SELECT * FROM "%s"' %
+                                                (t['name'],))))
+                    for t in list(tables))
+
+    def query(self, sql):
+        """
+        Runs ``sql`` against the database and yields each row it returns as a
+        dictionary of column name to value
+        """
+        conn, db_error = self._connect()
+        try:
+            cursor = conn.cursor()
             try:
-                self._data = load_yaml(self.file_path)
-            except IOError as e:
-                raise InvalidConfigurationError("The given model file cannot be "
-                        "opened: %s" % (self.file_path,))
-            except YAMLError as e:
+                cursor.execute(sql)
+                if cursor.description is None:
+                    raise InvalidConfigurationError("Model query does not "
+                            "return any rows: %s" % (sql,))
+                columns = [d[0] for d in cursor.description]
+
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(zip(columns, row))
+            except db_error as e:
                 raise InvalidConfigurationError(
-                        "Error parsing model yaml file (%s): %s" % (self.file_path, e))
-         
-        return self._data
+                        "Error querying model database (%s): %s" %
+                        (self.file_path, e))
+        finally:
+            conn.close()
+
+
+ext_to_source = {
+    '.yaml': YAMLFileModelSource,
+    '.yml': YAMLFileModelSource,
+    '.json': JSONFileModelSource,
+    '.msgpack': MsgpackFileModelSource,
+    '.mpk': MsgpackFileModelSource,
+    '.db': SqliteModelSource,
+    '.sqlite': SqliteModelSource,
+    '.sqlite3': SqliteModelSource,
+}
+
+
+class FragmentModelSource(ModelSource):
+    """
+    A model merged from several fragment files, each of which holds the value
+    of the top level key named after the file (minus its extension), e.g.
+    ``entities/user.yaml`` holds ``user``.  Fragments are loaded through a
+    :class:`ModelRegistry` the first time their key is read, and their key is
+    fingerprinted by the hash of the fragment file, so a template only pays
+    for the fragments it uses and only re-renders when one of those changes.
+    """
+    def __init__(self, file_paths, registry):
+        """
+        :param file_paths: The fragment files of the model
+        :param registry: The :class:`ModelRegistry` to load fragments from
+        """
+        self.file_paths = file_paths
+        self.registry = registry
+
+        self._fragments = {}
+        for path in file_paths:
+            key = os.path.splitext(os.path.basename(path))[0]
+            if key in self._fragments:
+                raise InvalidConfigurationError("Model fragments %s and %s "
+                        "are both for the key '%s'" %
+                        (self._fragments[key], path, key))
+            self._fragments[key] = path
+
+    @classmethod
+    def fragment_files(cls, dir_path):
+        """
+        Returns the model files in ``dir_path`` that are in a format a model
+        can be loaded from
+        """
+        return sorted(os.path.join(dir_path, f) for f in os.listdir(dir_path)
+                      if not f.startswith('.') and
+                         os.path.splitext(f)[1].lower() in ext_to_source)
+
+    def _fragment(self, key):
+        return self.registry.get(self._fragments[key])
+
+    @property
+    def data(self):
+        return dict((k, self.get(k)) for k in self.keys())
+
+    def keys(self):
+        return sorted(self._fragments)
+
+    def get(self, key, default=None):
+        if key not in self._fragments:
+            return default
+        return self._fragment(key).data
+
+    def key_fingerprint(self, key):
+        if key not in self._fragments:
+            return fingerprint(None)
+        return self._fragment(key).fingerprint
+
+    @property
+    def last_modified(self):
+        return max(os.stat(p)[ST_MTIME] for p in self.file_paths)
+
+    @property
+    def fingerprint(self):
+        return fingerprint([(k, self.key_fingerprint(k)) for k in self.keys()])
+
+
+class ModelSnapshotCache(object):
+    """
+    Parsed model data pickled into a cache directory, one snapshot per model
+    file, along with the hash of the file it was parsed from.  A snapshot is
+    only used while the file still has that hash, so loading it is always
+    equivalent to parsing the file again.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, source):
+        name = hash_text('%s\0%s' % (source.__class__.__name__,
+                                      os.path.abspath(source.file_path)))
+        return os.path.join(self.cache_dir, name + '.pickle')
+
+    def load(self, source):
+        """
+        Returns ``(True, data)`` if there is an up to date snapshot for
+        ``source``, otherwise ``(False, None)``
+        """
+        try:
+            with open(self._path(source), 'rb') as fh:
+                source_hash, data = pickle.load(fh)
+        except IOError as e:
+            self.misses += 1
+            return False, None
+        except Exception as e:
+            cw.warning("Ignoring unreadable model snapshot for %s: %s" %
+                    (source.file_path, e))
+            self.misses += 1
+            return False, None
+
+        if source_hash != source.fingerprint:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, data
+
+    def store(self, source, data):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            atomic_write(self._path(source),
+                    pickle.dumps((source.fingerprint, data), 2), binary=True)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            cw.warning("Cannot write model snapshot for %s: %s" %
+                    (source.file_path, e))
+
+
+# The registry used by default, so that parsed models are shared by every
+# builder that runs in the same process.
+model_registry = ModelRegistry()
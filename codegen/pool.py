@@ -0,0 +1,159 @@
+import sys
+import threading
+
+
+class OrderedPool(object):
+    """
+    Maps a function over a sequence of items on a bounded number of worker
+    threads.  Results are handed back in the order of the items regardless of
+    the order they finish in, and the first failure stops any work that has
+    not been started yet before its exception is re-raised to the caller.
+
+    Items are pulled from the sequence only as workers become free, and
+    workers never get more than ``window`` items ahead of the caller, so an
+    arbitrarily long generator can be mapped in bounded memory.
+    """
+    def __init__(self, jobs=1, window=None):
+        self.jobs = max(1, int(jobs))
+        self.window = window or self.jobs * 2
+
+    def imap(self, func, items):
+        if self.jobs == 1:
+            for item in items:
+                yield func(item)
+            return
+
+        run = _OrderedRun(func, iter(items), self.window)
+        threads = [threading.Thread(target=run.work)
+                   for i in range(self.jobs)]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+        try:
+            while True:
+                ok, value = run.next_result()
+                if ok is None:
+                    return
+                if not ok:
+                    break
+                yield value
+
+            # Something failed; let the work in flight finish and raise the
+            # error of the earliest item that failed.
+            run.cancel()
+            for t in threads:
+                t.join()
+
+            exc_info = run.first_error()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            # Nothing is left running once the caller stops, however it stops
+            run.cancel()
+            for t in threads:
+                t.join()
+
+
+class _OrderedRun(object):
+    """
+    The state shared by the workers and the caller of one
+    :meth:`OrderedPool.imap`
+    """
+    def __init__(self, func, items, window):
+        self.func = func
+        self.items = items
+        self.window = window
+        self.cond = threading.Condition()
+        self.items_lock = threading.Lock()
+        self.cancelled = False
+        self.exhausted = False
+        self.next_index = 0
+        self.next_yield = 0
+        self.results = {}
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notifyAll()
+
+    def _take(self):
+        """
+        Returns the next ``(index, item)`` to work on, or ``None`` if there is
+        nothing more to do
+        """
+        # The window is checked while holding the items, so that no other
+        # worker can take one in between
+        with self.items_lock:
+            with self.cond:
+                while (not self.cancelled and
+                        self.next_index - self.next_yield >= self.window):
+                    self.cond.wait(0.5)
+
+            if self.exhausted or self.cancelled:
+                return None
+
+            index = self.next_index
+            try:
+                item = next(self.items)
+            except StopIteration:
+                with self.cond:
+                    self.exhausted = True
+                    self.cond.notifyAll()
+                return None
+            except Exception:
+                self._finish(index, (False, sys.exc_info()))
+                self.next_index += 1
+                return None
+
+            self.next_index += 1
+
+        return index, item
+
+    def _finish(self, index, result):
+        with self.cond:
+            self.results[index] = result
+            if not result[0]:
+                self.cancelled = True
+            self.cond.notifyAll()
+
+    def work(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+
+            index, item = taken
+            try:
+                result = (True, self.func(item))
+            except Exception:
+                result = (False, sys.exc_info())
+            self._finish(index, result)
+
+    def next_result(self):
+        """
+        Waits for the result of the next item in order.  Returns ``(None,
+        None)`` once every item has been handed back, or ``(False, None)`` if
+        the run was cancelled before the result was ready.
+        """
+        with self.cond:
+            index = self.next_yield
+            while index not in self.results:
+                if self.exhausted and index >= self.next_index:
+                    return None, None
+                if self.cancelled:
+                    return False, None
+                self.cond.wait(0.5)
+
+            result = self.results.pop(index)
+            if result[0]:
+                self.next_yield += 1
+                self.cond.notifyAll()
+            else:
+                self.results[index] = result
+
+            return result
+
+    def first_error(self):
+        with self.cond:
+            failed = sorted(i for i, r in self.results.items() if not r[0])
+            return self.results[failed[0]][1]
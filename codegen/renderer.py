@@ -14,66 +14,167 @@ TODO: Custom sections are not yet supported in languages that do not have a
 single "rest of line" comment delimiter (like CSS, which only has `/* */` and no
 '//' or '#' like Java or Python/Perl)
 """
+import Queue
+import fnmatch
 import os
 import sys
 import re
+import threading
 from copy import deepcopy
 
-from org.stringtemplate.v4 import ST
-
 #from templates import common
 
-from .consolewriter import ConsoleWriter
-from .beautifier import Beautifier
+from .consolewriter import cw
+from .beautifier import set_format_cache
 
 from .exceptions import (
         CodegenError,
         InvalidConfigurationError,
     )
-from .models import YAMLFileModelSource, TemplateModel
-from .templates import STTemplate, TemplateWriter
-from .util import load_yaml, inject_st_with_dict
-
-cw = ConsoleWriter()
-
+from .formatcache import FormatCache
+from .manifest import BuildManifest
+from .models import ModelSnapshotCache, TemplateModel, model_registry
+from .pool import OrderedPool
+from .shard import shard_templates
+from .stats import build_stats
+from .templates import (
+        TemplateWriter,
+        TransactionalTemplateWriter,
+        template_type_to_class,
+    )
+from .util import fingerprint, load_yaml
 
-# TODO: make this a registry that is updated via a metaclass on ``Template``
-template_type_to_class = {
-        "st": STTemplate,
-    }
+# Importing the template types registers them in template_type_to_class
+from . import jinja
+try:
+    from .stringtemplate import group_cache
+except ImportError:
+    # StringTemplate needs Jython
+    group_cache = None
 
 class Builder(object):
-    def __init__(self, config):
+    def __init__(self, config, model_registry=model_registry):
+        """
+        :param config: The merged configuration for the build
+        :param model_registry: The :class:`ModelRegistry` that parsed models
+         are shared through.  Defaults to the process wide registry.
+        """
         self.config = config
+        self.model_registry = model_registry
+        self.model_registry.snapshots = self.model_snapshots
         self.renderer = Renderer()
 
     @property
     def templates(self):
+        """
+        The list of every template in the build.  Rendering does not need
+        this; it consumes :meth:`iter_templates` as it goes instead.
+        """
         if not hasattr(self, '_templates'):
-            try:
-                template_config = self.config['templates']
-            except KeyError as e:
-                raise InvalidConfigurationError("You must define a 'templates' "
-                        "property in your configuration!")
+            self._templates = list(self.iter_templates())
 
-            #model_file = config['model_file']
-            #template_dir = config['template_dir']
+        return self._templates
 
-            templates = []
+    def iter_templates(self):
+        """
+        Lazily expands the selected configuration entries into templates, one
+        ``forModelPaths`` fan-out at a time.
+        """
+        try:
+            template_config = self.config['templates']
+        except KeyError as e:
+            raise InvalidConfigurationError("You must define a 'templates' "
+                    "property in your configuration!")
+
+        for t in self._select(template_config):
             try:
-                for t in template_config:
-                    templates.extend(self._create_templates(t))
+                for template in self._create_templates(t):
+                    yield template
             except KeyError as e:
                 raise InvalidConfigurationError(
                         "Missing required template attribute: %s" % (e.message,))
 
-            self._templates = templates
+    def selected_templates(self):
+        """
+        The templates this build renders: all of them, or with ``--shard``
+        only those of the given shard, which needs every template to be
+        expanded first.
+        """
+        if not self.config['shard']:
+            return self.iter_templates()
 
-        return self._templates
+        return shard_templates(self.templates, self.config['shard'],
+                self.config['shard_stats'])
+
+    def _select(self, template_config):
+        """
+        Returns the template configuration entries whose names match any of
+        the names or glob patterns given on the command line, or all of them
+        if none were given.  The models and groups of the other entries are
+        never loaded.
+        """
+        patterns = self._patterns()
+        if not patterns:
+            return template_config
+
+        selected = [t for t in template_config
+                    if any(fnmatch.fnmatchcase(t['name'], p) for p in patterns)]
+        if not selected:
+            raise InvalidConfigurationError("No templates match: %s" %
+                    (', '.join(patterns),))
+
+        return selected
+
+    def _patterns(self):
+        try:
+            return self.config['to_render']
+        except KeyError as e:
+            return None
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self.config['base_dir'], self.config['cache_dir'])
+
+    @property
+    def manifest(self):
+        """
+        The :class:`BuildManifest` of the build, loaded the first time it is
+        needed
+        """
+        if not hasattr(self, '_manifest'):
+            self._manifest = BuildManifest.for_config(self.config)
+
+        return self._manifest
+
+    @property
+    def format_cache(self):
+        if not hasattr(self, '_format_cache'):
+            self._format_cache = None
+            if self.config['pretty_print'] and self.config['format_cache']:
+                self._format_cache = FormatCache(
+                        os.path.join(self.cache_dir, 'format'),
+                        self.config['format_cache_size'] * 1024 * 1024)
+
+        return self._format_cache
+
+    @property
+    def model_snapshots(self):
+        if not self.config['model_snapshots']:
+            return None
+
+        return ModelSnapshotCache(os.path.join(self.cache_dir, 'models'))
+
+    def reset(self):
+        """
+        Forgets the expanded templates so that the next access to
+        :attr:`templates` expands the configuration against the current
+        models.  Parsed models and compiled groups are kept in their caches.
+        """
+        if hasattr(self, '_templates'):
+            del self._templates
 
 
     def _create_templates(self, t_config):
-        templates = []
         try:
             model_file = t_config['model_file']
         except KeyError:
@@ -84,55 +185,366 @@ class Builder(object):
                     "Your must specify a template model.  You do not have a "
                     "global model and did not specify one for this template: "
                     "%s" % (t_config['name'],))
-        model = TemplateModel(YAMLFileModelSource(model_file))
-        filepath = os.path.join(self.config['template_dir'], t_config['name'])
+        model = TemplateModel.from_file(model_file, self.model_registry)
 
+        template_type = (t_config.get('template_type') or
+                         self.config['template_type'])
         try:
-            tmpl_cls = template_type_to_class[self.config['template_type']]
+            tmpl_cls = template_type_to_class[template_type]
         except KeyError as e:
             raise InvalidConfigurationError("Unknown template type: %s" %
-                    (self.config['template_type'],))
+                    (template_type,))
+        options = tmpl_cls.options(self.config)
 
-        # TODO: redo this to make adding more template types easier
         def mk_tmpl(render_path, model):
-            if issubclass(tmpl_cls, STTemplate):
-                return mk_st_tmpl(render_path, model)
-            else:
-                raise InvalidConfigurationError("We only support StringTemplate "
-                        "templates at this time!")
-
-        def mk_st_tmpl(render_path, model):
-            return tmpl_cls(
+            return tmpl_cls.from_config(
                 t_config['name'],
-                os.path.join(self.config['template_dir'], t_config['name']+'.stg'),
+                self.config['template_dir'],
                 render_path,
                 model,
                 force = self.config['force'],
-                pretty = self.config['pretty_print']
+                pretty = self.config['pretty_print'],
+                config = t_config,
+                **options
             )
 
-        if 'for_model_paths' in t_config:
-            for model_path in t_config['for_model_paths']:
-                submodel = model.get_path(model_path)
-                st = inject_st_with_dict(ST(t_config['render_path']), submodel)
-                templates.append(mk_tmpl(
-                        st.render(),
-                        submodel
-                    ))
+        if t_config.get('for_model_paths'):
+            for model_path, render_path in self._expand(t_config, tmpl_cls,
+                                                        model):
+                yield mk_tmpl(
+                        render_path,
+                        model.view(model_path)
+                    )
+        elif t_config.get('for_query'):
+            render_path = tmpl_cls.render_path_renderer(t_config['render_path'])
+            for row in model.query(t_config['for_query']):
+                yield mk_tmpl(
+                        render_path(dict(row.items())),
+                        row
+                    )
         else:
-            templates.append(mk_tmpl(
+            yield mk_tmpl(
                     t_config['render_path'],
                     model
-                ))
+                )
+
+    def _expand(self, t_config, tmpl_cls, model):
+        """
+        Yields the model path and render path of each output of a
+        ``forModelPaths`` template.  These are recorded in the manifest, so
+        that while the model and the configuration entry stay the same the
+        model does not have to be loaded just to find them again.
+        """
+        name = t_config['name']
+        key = self._expansion_key(t_config)
+        model_source = model.source_fingerprint
+        paths = self.manifest.expansion(key, model_source)
+        if paths is not None:
+            for pair in paths:
+                yield pair
+            return
+
+        render_path = tmpl_cls.render_path_renderer(t_config['render_path'])
+        paths = []
+        for selector in t_config['for_model_paths']:
+            for model_path in model.resolve(selector):
+                if not isinstance(model.get_path(model_path), dict):
+                    raise InvalidConfigurationError(
+                            "Model path '%s' matched by '%s' in template '%s' "
+                            "is not a map" % (model_path, selector, name))
+                submodel = model.view(model_path)
+                paths.append((model_path,
+                              render_path(self._path_attributes(submodel))))
+                yield paths[-1]
+
+        self.manifest.record_expansion(key, model_source, paths)
+
+    def _expansion_key(self, t_config):
+        """
+        Identifies the expansion of a configuration entry in the manifest by
+        everything it depends on besides the model, since several entries can
+        share a template name
+        """
+        return fingerprint({
+            'entry': t_config,
+            'template_type': (t_config.get('template_type') or
+                              self.config['template_type']),
+        })
+
+    @staticmethod
+    def _path_attributes(submodel):
+        """
+        Returns the attributes the render path of a fan-out template is
+        rendered with: the keys of its submodel, along with the concrete path
+        it came from as ``modelPath`` and the last element of that as
+        ``modelKey``, unless the submodel has keys of its own with those names.
+        """
+        attributes = {
+            'modelPath': submodel.path,
+            'modelKey': submodel.path.rsplit('.', 1)[-1],
+        }
+        attributes.update(submodel.items())
+        return attributes
+
+    def render_templates(self, templates=None):
+        """
+        Renders ``templates``, or every template of the build (or shard) if
+        not given, skipping those whose inputs have not changed since the
+        last build.
+        """
+        manifest = self.manifest
+        if templates is None:
+            templates = self.selected_templates()
+            if self.config['shard']:
+                # Outputs that the balance has moved to another shard since
+                # the last build, or that are gone, are not this shard's any
+                # more.  Only the selected templates are known when they are
+                # named on the command line.
+                among = self.templates if self._patterns() else None
+                manifest.retain(templates, among)
+        skipped = [0]
+
+        def to_render():
+            for t in templates:
+                with build_stats.template(t):
+                    needs_render = t.needs_render(manifest)
+                if needs_render:
+                    t.build_entry = manifest.get(t)
+                    yield t
+                else:
+                    skipped[0] += 1
+
+        if self.config['transactional']:
+            tw = TransactionalTemplateWriter(self.config['base_dir'], manifest)
+        else:
+            tw = TemplateWriter(manifest, self.config['base_dir'])
+
+        def render(template):
+            return self._render(template, tw)
+
+        batches = BatchQueue(self.renderer, tw)
+        pool = OrderedPool(self.config['jobs'])
+        set_format_cache(self.format_cache)
+        results = pool.imap(render, to_render())
+        try:
+            try:
+                for t, output, messages in results:
+                    cw.replay(messages)
+                    if isinstance(output, PendingOutput):
+                        batches.add(output)
+                    else:
+                        tw.add(t, output)
+            finally:
+                # Stops the workers before the spool directory is removed
+                results.close()
+            batches.flush()
+            manifest.retain_expansions(self._expansion_key(t)
+                    for t in self.config['templates']
+                    if t.get('for_model_paths'))
+            tw.commit()
+        except:
+            exc_info = sys.exc_info()
+            # The messages of the failed template lead up to its error
+            cw.replay(getattr(exc_info[1], 'console_messages', []))
+            batches.close()
+            tw.abort()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            # Whatever made it to disk is recorded, even if the build failed
+            manifest.save()
+
+        cw.output("%d written, %d unchanged, %d skipped" %
+                (tw.written, tw.unchanged, skipped[0]))
+        cw.debug("Model cache: %d hits, %d misses" %
+                (self.model_registry.hits, self.model_registry.misses))
+        if group_cache is not None:
+            cw.debug("Group cache: %d hits, %d misses" %
+                    (group_cache.hits, group_cache.misses))
+        if self.format_cache is not None:
+            cw.debug("Format cache: %d hits, %d misses" %
+                    (self.format_cache.hits, self.format_cache.misses))
+
+        if build_stats.enabled:
+            self._report_stats(skipped[0], tw.written + tw.unchanged)
+
+    def _report_stats(self, skipped, rendered):
+        build_stats.set_cache('manifest', skipped, rendered)
+        build_stats.set_cache('model', self.model_registry.hits,
+                self.model_registry.misses)
+        snapshots = self.model_registry.snapshots
+        if snapshots is not None:
+            build_stats.set_cache('model snapshot', snapshots.hits,
+                    snapshots.misses)
+        if group_cache is not None:
+            build_stats.set_cache('group', group_cache.hits,
+                    group_cache.misses)
+        if self.format_cache is not None:
+            build_stats.set_cache('format', self.format_cache.hits,
+                    self.format_cache.misses)
+
+        if self.config['stats']:
+            build_stats.report(self.config['stats_top'])
+        if self.config['stats_json']:
+            build_stats.write_json(self.config['stats_json'],
+                    self.config['stats_top'])
+
+        # Start afresh for the next build of a watching process
+        build_stats.reset()
+
+    def list_templates(self):
+        """
+        Prints every template the build would render and the path it would
+        render to, without rendering anything
+        """
+        for t in self.selected_templates():
+            cw.output("%s -> %s" % (t, t.render_path))
+
+    def _render(self, template, writer):
+        """
+        Renders a single template and runs its extensions, streaming the
+        output into a spool file of ``writer`` and holding back its console
+        messages so they can be replayed in template order.  Outputs that
+        wait for a batched extension are returned as a :class:`PendingOutput`
+        instead.  If the template fails, its messages are attached to the
+        error as ``console_messages``.
+        """
+        cw.capture()
+        try:
+            cw.output("Processing template: %s -> %s" %
+                    (template, template.render_path))
+            with build_stats.template(template):
+                output = self.renderer.render_template(template,
+                                                       writer.spool_dir)
+                if not isinstance(output, PendingOutput):
+                    with build_stats.phase('write'):
+                        output = writer.spool(output)
+        except Exception as e:
+            e.console_messages = cw.end_capture()
+            raise
+        finally:
+            messages = cw.end_capture()
+
+        return template, output, messages
+
+
+class PendingOutput(object):
+    """
+    The output of a template rendered up to an extension that processes
+    outputs in batches, see :attr:`RendererExtension.batcher`
+    """
+    def __init__(self, template, text, extension, rest):
+        """
+        :param text: The whole output so far
+        :param extension: The batched extension it is waiting for
+        :param rest: The extensions to run after that one
+        """
+        self.template = template
+        self.text = text
+        self.extension = extension
+        self.rest = rest
+
+    @property
+    def batcher(self):
+        return self.extension.batcher
+
+
+class BatchQueue(object):
+    """
+    The outputs of a build that are waiting for a batched extension.  Once
+    ``max_batch`` outputs wait for the same batcher they are handed to a
+    single formatter thread, so that processing them overlaps the rendering
+    of the rest of the build.  The batches it has finished are completed
+    with the rest of their extensions and added to the writer on the calling
+    thread the next time outputs are added or flushed, which keeps the
+    writer and manifest to one thread.
+
+    No more than ``max_queued`` full batches wait for the formatter thread,
+    beyond that adding outputs blocks until it catches up.
+    """
+    max_queued = 2
+
+    def __init__(self, renderer, writer):
+        self.renderer = renderer
+        self.writer = writer
+        self._pending = {}
+        self._queued = Queue.Queue(self.max_queued)
+        self._done = Queue.Queue()
+        self._thread = None
+
+    def add(self, pending):
+        queue = self._pending.setdefault(pending.batcher, [])
+        queue.append(pending)
+        if len(queue) >= pending.batcher.max_batch:
+            self._submit(pending.batcher)
+        self._finish_done()
+
+    def flush(self):
+        """
+        Processes every output still waiting, however few, and waits for the
+        formatter thread to finish them
+        """
+        for batcher in list(self._pending):
+            self._submit(batcher)
+        self.close()
+        self._finish_done()
+
+    def close(self):
+        """
+        Stops the formatter thread once it is done with the batches handed to
+        it.  Batches that have not been finished are dropped.
+        """
+        if self._thread is not None:
+            self._queued.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _submit(self, batcher):
+        queue = self._pending.pop(batcher, [])
+        if not queue:
+            return
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._process)
+            self._thread.setDaemon(True)
+            self._thread.start()
+        self._queued.put(queue)
+
+    def _process(self):
+        while True:
+            queue = self._queued.get()
+            if queue is None:
+                return
+
+            # Messages are replayed by the calling thread like those of the
+            # workers
+            cw.capture()
+            try:
+                with build_stats.phase(queue[0].extension.__class__.__name__):
+                    results = queue[0].batcher.process_all(
+                            [p.text for p in queue])
+                exc_info = None
+            except Exception as e:
+                results, exc_info = None, sys.exc_info()
+            self._done.put((queue, results, cw.end_capture(), exc_info))
+
+    def _finish_done(self):
+        while True:
+            try:
+                queue, results, messages, exc_info = self._done.get_nowait()
+            except Queue.Empty:
+                return
 
-        return templates
+            cw.replay(messages)
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
 
-    def render_templates(self):
-        tw = TemplateWriter()
-        for t in self.templates:
-            cw.output("Processing template: %s -> %s" % (t, t.render_path))
-            tw.add(t, self.renderer.render_template(t))
-        tw.write()
+            for pending, text in zip(queue, results):
+                template = pending.template
+                with build_stats.template(template):
+                    chunks = self.renderer.finish_template(pending, text)
+                    with build_stats.phase('write'):
+                        output = self.writer.spool(chunks)
+                self.writer.add(template, output)
 
 
 from .extensions import (
@@ -157,16 +569,49 @@ class Renderer(object):
         return [ ext_cls(template) for ext_cls in self.extensions ]
 
 
-    def render_template(self, template):
+    def render_template(self, template, spool_dir=None):
+        """
+        Returns the output of ``template`` after every extension as a lazy
+        stream of chunks of text.  Nothing is rendered until it is consumed.
+        If an extension processes outputs in batches, the output is rendered
+        up to that extension and returned as a :class:`PendingOutput`, to be
+        completed with :meth:`finish_template`.  Templates that spool their
+        output while rendering do so in ``spool_dir``.
+        """
         #print 'existing sections: ' + str(custom_sections)
         extension_instances = self.instantiate_extensions(template)
         for ext in extension_instances:
-            ext.pre_render()
+            with build_stats.phase(ext.__class__.__name__):
+                ext.pre_render()
 
-        output = template.render()
+        output = template.render_chunks(spool_dir)
 
-        for ext in extension_instances:
-            output = ext.post_render(output)
+        for i, ext in enumerate(extension_instances):
+            if ext.batcher is not None:
+                return PendingOutput(template, u''.join(output), ext,
+                                     extension_instances[i + 1:])
+            output = build_stats.timed(ext.__class__.__name__,
+                                       self._post_render(ext, output))
+
+        return output
+
+    def finish_template(self, pending, text):
+        """
+        Returns the output of a :class:`PendingOutput` after the rest of its
+        extensions, given its ``text`` as processed by the batched extension
+        """
+        output = iter([text])
+        for ext in pending.rest:
+            output = build_stats.timed(ext.__class__.__name__,
+                                       self._post_render(ext, output))
 
         return output
 
+    @staticmethod
+    def _post_render(ext, chunks):
+        if ext.needs_full_text:
+            yield ext.post_render(u''.join(chunks))
+        else:
+            for chunk in ext.post_render_chunks(chunks):
+                yield chunk
+
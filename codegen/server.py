@@ -0,0 +1,198 @@
+import binascii
+import json
+import os
+import socket
+import sys
+import threading
+import SocketServer
+
+from .client import token_path
+from .consolewriter import cw
+from .exceptions import CodegenError
+
+"""
+A resident codegen process that runs builds sent to it by
+``codegen-client``.  The model registry and group cache live for as long as
+the server does, so only the models and group files that changed since the
+previous build have to be loaded again.
+
+The server listens on a Unix socket where the platform supports them.
+Jython does not, so there the server listens on a loopback TCP port and
+writes ``host:port`` to the socket path for the client to read instead.
+Either way the server runs builds as the user that started it, so it writes
+a random token to a file only that user can read, next to the socket, and
+refuses any request that does not carry it.
+
+The protocol is line based JSON.  The client sends a single request,
+``{"argv": [...], "cwd": "...", "token": "..."}``, and the server answers
+with any number of ``{"stream": "out"|"err", "data": "..."}`` messages
+followed by a final ``{"exit": status}``.
+"""
+
+# The number of random bytes in the token requests are authorized with
+TOKEN_BYTES = 32
+
+def write_private(path, text):
+    """
+    Writes ``text`` to a new file at ``path`` that only the current user can
+    read or write
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    os.chmod(path, 0600)
+    with os.fdopen(fd, 'w') as fh:
+        fh.write(text)
+
+def same_token(expected, given):
+    """
+    Compares tokens in constant time, so that a token cannot be guessed a
+    character at a time
+    """
+    if not isinstance(given, basestring) or len(given) != len(expected):
+        return False
+
+    result = 0
+    for x, y in zip(expected, given):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class SocketStream(object):
+    """
+    A file-like object that forwards everything written to it to the client
+    as messages for one of its output streams.
+    """
+    def __init__(self, wfile, name, lock):
+        self.wfile = wfile
+        self.name = name
+        self.lock = lock
+
+    def write(self, data):
+        send_message(self.wfile, {'stream': self.name, 'data': data},
+                self.lock)
+
+    def flush(self):
+        pass
+
+
+def send_message(wfile, message, lock):
+    with lock:
+        wfile.write(json.dumps(message) + '\n')
+        wfile.flush()
+
+
+class BuildRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            argv = list(request['argv'])
+            cwd = request['cwd']
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return
+
+        lock = threading.Lock()
+        if not same_token(self.server.token, request.get('token')):
+            send_message(self.wfile, {'stream': 'err', 'data': "Error: the "
+                    "request does not carry the token of the server\n"},
+                    lock)
+            send_message(self.wfile, {'exit': 1}, lock)
+            return
+
+        status = self.server.run_build(argv, cwd,
+                SocketStream(self.wfile, 'out', lock),
+                SocketStream(self.wfile, 'err', lock))
+        send_message(self.wfile, {'exit': status}, lock)
+
+
+class BuildServerMixin(object):
+    token = None
+
+    def create_token(self, socket_path):
+        self.token = binascii.hexlify(os.urandom(TOKEN_BYTES))
+        write_private(token_path(socket_path), self.token + '\n')
+
+    def run_build(self, argv, cwd, stdout, stderr):
+        """
+        Runs a build exactly as ``codegen`` would from ``cwd``.  Builds are
+        handled one at a time, since each one changes the working directory
+        and standard streams of the whole process.  Starting another server
+        or a watch, which would never return, is refused.
+        """
+        from .config import CommandLineConfig
+        from .main import run
+
+        old_cwd = os.getcwd()
+        old_streams = (sys.stdout, sys.stderr)
+        try:
+            os.chdir(cwd)
+            sys.stdout, sys.stderr = stdout, stderr
+            cw.indent = 0
+            cl_cfg = CommandLineConfig(argv)
+            if cl_cfg['server'] or cl_cfg['watch']:
+                stderr.write("Error: --server and --watch cannot be run by "
+                        "the codegen server\n")
+                return 1
+
+            return run(argv)
+        except SystemExit as e:
+            # optparse exits on --help and bad arguments
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            import traceback
+            stderr.write(traceback.format_exc())
+            return 1
+        finally:
+            sys.stdout, sys.stderr = old_streams
+            os.chdir(old_cwd)
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class BuildServer(BuildServerMixin, SocketServer.UnixStreamServer):
+        def __init__(self, socket_path):
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+            # Only the user running the server may connect
+            old_umask = os.umask(0177)
+            try:
+                SocketServer.UnixStreamServer.__init__(self, socket_path,
+                        BuildRequestHandler)
+            finally:
+                os.umask(old_umask)
+            os.chmod(socket_path, 0600)
+            self.create_token(socket_path)
+else:
+    class BuildServer(BuildServerMixin, SocketServer.TCPServer):
+        allow_reuse_address = True
+
+        def __init__(self, socket_path):
+            SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0),
+                    BuildRequestHandler)
+            write_private(socket_path, '%s:%d\n' % self.server_address)
+            self.create_token(socket_path)
+
+
+def serve(socket_path):
+    """
+    Serves builds on ``socket_path`` until interrupted
+    """
+    socket_path = os.path.abspath(socket_path)
+    try:
+        server = BuildServer(socket_path)
+    except (socket.error, IOError, OSError) as e:
+        raise CodegenError("Cannot listen on %s: %s" % (socket_path, e))
+
+    cw.output("Codegen server listening on %s" % (socket_path,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for path in (socket_path, token_path(socket_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return 0
@@ -0,0 +1,190 @@
+import glob
+import heapq
+import json
+import os
+import re
+import shutil
+
+from .consolewriter import cw
+from .exceptions import CodegenError, InvalidConfigurationError
+from .manifest import MANIFEST_FILENAME, BuildManifest
+from .util import hash_file, hash_text
+
+"""
+Splitting a build across machines with ``--shard i/n`` and combining the
+shards again with ``--merge-shards``
+"""
+
+SHARD_REGEX = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+SHARD_MANIFEST_REGEX = re.compile(r'\.shard-(\d+)-of-(\d+)$')
+
+
+def parse_shard(spec):
+    """
+    Returns the ``(index, count)`` of a shard given as ``i/n``, where ``i``
+    counts from 1
+    """
+    match = SHARD_REGEX.match(spec)
+    if not match:
+        raise InvalidConfigurationError("Shards must be given as i/n, "
+                "e.g. 3/8, not: %s" % (spec,))
+
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise InvalidConfigurationError("There is no shard %d of %d" %
+                (index, count))
+
+    return index, count
+
+def shard_manifest_path(base_dir, spec):
+    """
+    The path of the manifest that the shard ``spec`` records its outputs in
+    """
+    return os.path.join(base_dir, '%s.shard-%d-of-%d' %
+                        ((MANIFEST_FILENAME,) + parse_shard(spec)))
+
+def _key(template):
+    return os.path.normpath(template.render_path)
+
+def load_costs(stats_path):
+    """
+    Returns the time each template took to render in the build that wrote
+    the ``--stats-json`` file ``stats_path``, by render path
+    """
+    try:
+        with open(stats_path, 'r') as fh:
+            stats = json.load(fh)
+    except (IOError, ValueError) as e:
+        cw.warning("Balancing shards by template count, since the build "
+                "stats cannot be read (%s): %s" % (stats_path, e))
+        return {}
+
+    return dict((os.path.normpath(t['render_path']), t['wall'])
+                for t in stats.get('templates', []))
+
+def assign(templates, count, costs=None):
+    """
+    Splits ``templates`` into ``count`` lists of about the same total cost,
+    by giving the most expensive remaining template to the least loaded
+    shard.  Templates without a known cost are taken to cost the average.
+    The result only depends on the render paths and the costs, so every
+    machine of a sharded build arrives at the same split.
+    """
+    costs = costs or {}
+    default = sum(costs.values()) / len(costs) if costs else 1.0
+
+    # Ties are broken by a hash of the render path rather than the path
+    # itself, so that the templates of one directory are spread out
+    weighted = sorted((-costs.get(_key(t), default), hash_text(_key(t)), i)
+                      for i, t in enumerate(templates))
+
+    shards = [[] for i in range(count)]
+    loads = [(0.0, i) for i in range(count)]
+    for neg_cost, path_hash, i in weighted:
+        load, shard = heapq.heappop(loads)
+        shards[shard].append(i)
+        heapq.heappush(loads, (load - neg_cost, shard))
+
+    return [[templates[i] for i in sorted(shard)] for shard in shards]
+
+def shard_templates(templates, spec, stats_path=None):
+    """
+    Returns the templates of ``templates`` that belong to the shard ``spec``,
+    balanced by the render times in ``stats_path`` if given
+    """
+    index, count = parse_shard(spec)
+    costs = load_costs(stats_path) if stats_path else None
+    return assign(list(templates), count, costs)[index - 1]
+
+
+def _find_shard_manifests(shard_dirs):
+    found = {}
+    count = None
+    for shard_dir in shard_dirs:
+        pattern = os.path.join(shard_dir, MANIFEST_FILENAME + '.shard-*-of-*')
+        for path in sorted(glob.glob(pattern)):
+            match = SHARD_MANIFEST_REGEX.search(path)
+            if not match:
+                continue
+            index, n = int(match.group(1)), int(match.group(2))
+            if count is not None and n != count:
+                raise CodegenError("Cannot merge shards of a %d way and a %d "
+                        "way build: %s" % (count, n, path))
+            count = n
+            if index in found:
+                raise CodegenError("Found two manifests for shard %d: %s and "
+                        "%s" % (index, found[index][1], path))
+            found[index] = (shard_dir, path)
+
+    if not found:
+        raise CodegenError("No shard manifests found in: %s" %
+                (', '.join(shard_dirs),))
+
+    missing = [str(i) for i in range(1, count + 1) if i not in found]
+    if missing:
+        raise CodegenError("Missing the manifests of shards %s of %d" %
+                (', '.join(missing), count))
+
+    return found
+
+def _copy_output(shard_dir, base_dir, path, entry, index):
+    if os.path.isabs(path):
+        src = dst = path
+    else:
+        src = os.path.join(shard_dir, path)
+        dst = os.path.join(base_dir, path)
+
+    if not os.path.isfile(src):
+        raise CodegenError("Output %s of shard %d is missing" % (src, index))
+    if hash_file(src) != entry.get('output'):
+        raise CodegenError("Output %s does not match the manifest of shard "
+                "%d" % (src, index))
+
+    if os.path.abspath(src) != os.path.abspath(dst):
+        dst_dir = os.path.dirname(dst)
+        if dst_dir and not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+        shutil.copy2(src, dst)
+
+def merge_shards(base_dir, shard_dirs=None):
+    """
+    Combines the manifests of every shard of a sharded build into the
+    manifest in ``base_dir``, failing if two shards wrote the same path.
+    Shards are looked for in ``shard_dirs``, or ``base_dir`` if not given.
+    The outputs of shards in other directories are copied into ``base_dir``
+    and every output is checked against the manifest that recorded it.
+    """
+    found = _find_shard_manifests(shard_dirs or [base_dir])
+
+    owners = {}
+    overlaps = []
+    shards = []
+    for index in sorted(found):
+        shard_dir, path = found[index]
+        manifest = BuildManifest(path)
+        for key in sorted(manifest.entries):
+            if key in owners:
+                overlaps.append("  %s (shards %d and %d)" %
+                        (key, owners[key], index))
+            else:
+                owners[key] = index
+        shards.append((index, shard_dir, manifest))
+
+    if overlaps:
+        raise CodegenError("More than one shard wrote the same paths:\n%s" %
+                ('\n'.join(overlaps),))
+
+    merged = BuildManifest(os.path.join(base_dir, MANIFEST_FILENAME))
+    merged.entries = {}
+    for index, shard_dir, manifest in shards:
+        for key, entry in manifest.entries.items():
+            try:
+                _copy_output(shard_dir, base_dir, key, entry, index)
+            except (IOError, OSError) as e:
+                raise CodegenError("Problem copying output %s of shard %d: "
+                        "%s" % (key, index, e))
+            merged.entries[key] = entry
+    merged.save()
+
+    cw.output("Merged %d shards with %d outputs" %
+            (len(shards), len(merged.entries)))
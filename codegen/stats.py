@@ -0,0 +1,248 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from . import __version__
+from .consolewriter import cw
+from .exceptions import CodegenError
+
+"""
+Timings and cache statistics of a build, reported with ``--stats`` and
+``--stats-json``
+"""
+
+# The number of slowest templates listed in the report by default
+DEFAULT_SLOWEST_COUNT = 10
+
+try:
+    from java.lang.management import ManagementFactory
+    _thread_mx = ManagementFactory.getThreadMXBean()
+
+    def thread_cpu_time():
+        """
+        The CPU time used by the current thread, in seconds
+        """
+        return _thread_mx.getCurrentThreadCpuTime() / 1e9
+except ImportError:
+    def thread_cpu_time():
+        # Only the CPU time of the whole process is available here
+        return time.clock()
+
+
+class BuildStats(object):
+    """
+    Wall and CPU time spent in each phase of a build, in total and for each
+    template, along with the size of every output and the hits and misses of
+    the caches.  Nested phases are only counted once: the time spent loading
+    a model while injecting it is counted as model load, not injection.
+
+    Nothing is recorded unless the stats are enabled.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self, enabled=None):
+        """
+        Forgets everything recorded so far, and enables or disables recording
+        if ``enabled`` is given
+        """
+        if enabled is not None:
+            self.enabled = enabled
+        elif not hasattr(self, 'enabled'):
+            self.enabled = False
+
+        self.started = time.time()
+        self.phases = {}
+        self.templates = {}
+        self.caches = {}
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def template(self, template):
+        """
+        Attributes the phases run by this thread inside the block to
+        ``template``
+        """
+        if not self.enabled:
+            yield
+            return
+
+        previous = getattr(self._local, 'template', None)
+        self._local.template = template
+        try:
+            yield
+        finally:
+            self._local.template = previous
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the block as the phase ``name``
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._stack()
+        children = [0.0, 0.0]
+        stack.append(children)
+        wall, cpu = time.time(), thread_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall
+            cpu = thread_cpu_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+
+            self._add(name, wall - children[0], cpu - children[1])
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of ``iterable``, timing the work done to produce
+        them as the phase ``name``.  This is how the stages of a lazy
+        pipeline are timed, since their work is interleaved.
+        """
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+
+        stack = self._stack()
+        total = [0.0, 0.0]
+        items = iter(iterable)
+        try:
+            while True:
+                children = [0.0, 0.0]
+                stack.append(children)
+                wall, cpu = time.time(), thread_cpu_time()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    wall = time.time() - wall
+                    cpu = thread_cpu_time() - cpu
+                    stack.pop()
+                    if stack:
+                        stack[-1][0] += wall
+                        stack[-1][1] += cpu
+                    total[0] += wall - children[0]
+                    total[1] += cpu - children[1]
+
+                yield item
+        finally:
+            self._add(name, total[0], total[1])
+
+    def _template_entry(self, template):
+        key = template.render_path
+        if key not in self.templates:
+            self.templates[key] = {
+                'name': str(template),
+                'render_path': key,
+                'bytes': None,
+                'phases': {},
+            }
+        return self.templates[key]
+
+    @staticmethod
+    def _add_to(phases, name, wall, cpu):
+        timing = phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'count': 0})
+        timing['wall'] += wall
+        timing['cpu'] += cpu
+        timing['count'] += 1
+
+    def _add(self, name, wall, cpu):
+        template = getattr(self._local, 'template', None)
+        with self._lock:
+            self._add_to(self.phases, name, wall, cpu)
+            if template is not None:
+                self._add_to(self._template_entry(template)['phases'],
+                             name, wall, cpu)
+
+    def add_output(self, template, size):
+        """
+        Records the size in bytes of the output of ``template``
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._template_entry(template)['bytes'] = size
+
+    def set_cache(self, name, hits, misses):
+        self.caches[name] = {'hits': hits, 'misses': misses}
+
+    @staticmethod
+    def _total(entry, key):
+        return sum(p[key] for p in entry['phases'].values())
+
+    def slowest(self, count=DEFAULT_SLOWEST_COUNT):
+        """
+        Returns the entries of the ``count`` templates that took the longest
+        """
+        return sorted(self.templates.values(),
+                      key=lambda e: self._total(e, 'wall'),
+                      reverse=True)[:count]
+
+    def as_dict(self, count=DEFAULT_SLOWEST_COUNT):
+        templates = []
+        for entry in sorted(self.templates.values(),
+                            key=lambda e: e['render_path']):
+            entry = dict(entry)
+            entry['wall'] = self._total(entry, 'wall')
+            entry['cpu'] = self._total(entry, 'cpu')
+            templates.append(entry)
+
+        return {
+            'version': __version__,
+            'wall': time.time() - self.started,
+            'phases': self.phases,
+            'caches': self.caches,
+            'templates': templates,
+            'slowest': [e['render_path'] for e in self.slowest(count)],
+        }
+
+    def report(self, count=DEFAULT_SLOWEST_COUNT):
+        """
+        Prints the time spent in each phase, the caches and the slowest
+        templates
+        """
+        cw.output("Build stats (%.3fs):" % (time.time() - self.started,))
+        cw.output("  %-24s %10s %10s %8s" % ('phase', 'wall', 'cpu', 'count'))
+        for name, timing in sorted(self.phases.items(),
+                                   key=lambda p: p[1]['wall'], reverse=True):
+            cw.output("  %-24s %9.3fs %9.3fs %8d" %
+                    (name, timing['wall'], timing['cpu'], timing['count']))
+
+        for name, cache in sorted(self.caches.items()):
+            cw.output("  %s cache: %d hits, %d misses" %
+                    (name, cache['hits'], cache['misses']))
+
+        slowest = self.slowest(count)
+        if slowest:
+            cw.output("  Slowest templates:")
+        for entry in slowest:
+            cw.output("  %9.3fs %s -> %s" % (self._total(entry, 'wall'),
+                    entry['name'], entry['render_path']))
+
+    def write_json(self, path, count=DEFAULT_SLOWEST_COUNT):
+        try:
+            with open(path, 'w') as fh:
+                json.dump(self.as_dict(count), fh, sort_keys=True, indent=1)
+        except (IOError, OSError) as e:
+            raise CodegenError("Problem writing build stats (%s): %s" %
+                    (path, e))
+
+
+# The stats of the build being run in this process
+build_stats = BuildStats()
@@ -0,0 +1,299 @@
+import os
+import tempfile
+import threading
+from stat import ST_MTIME
+
+from org.stringtemplate.v4 import (
+        ST,
+        AutoIndentWriter,
+        STGroupFile,
+        STGroupDir,
+        STErrorListener,
+        ModelAdaptor,
+        StringRenderer,
+    )
+from org.stringtemplate.v4.misc import (
+        STNoSuchPropertyException
+    )
+
+import java
+from java.io import (
+        BufferedWriter,
+        FileOutputStream,
+        OutputStreamWriter,
+        StringWriter,
+    )
+from java.lang import String
+
+from .exceptions import (
+        InvalidConfigurationError,
+        TemplateCompilationError,
+        TemplateRenderError,
+    )
+from .stats import build_stats
+from .templates import Template
+from .util import hash_file, inject_st_with_dict, read_chunks
+
+"""
+The StringTemplate template type, which needs Jython
+"""
+
+class STTemplate(Template):
+    """
+    A StringTemplate template wrapper
+    """
+    template_type = 'st'
+
+    class DictModelAdaptor(ModelAdaptor):
+        def getProperty(self, interp, tmpl, o, propertyObj, propertyName):
+            try:
+                return o[propertyName]
+            except KeyError:
+                return None
+                #raise STNoSuchPropertyException(None, o, propertyName)
+
+
+    class ErrorListener(STErrorListener):
+        def __init__(self):
+            self.compile_msgs = []
+            self.runtime_msgs = []
+            self.io_errors = []
+            self.internal_errors = []
+
+        def compileTimeError(self, msg):
+            self.compile_msgs.append(str(msg))
+
+        def runTimeError(self, msg):
+            self.runtime_msgs.append(str(msg))
+
+        def IOError(self, msg):
+            self.io_errors.append(str(msg))
+
+        def internalError(self, msg):
+            self.internal_errors.append(str(msg))
+
+        def check_errors(self):
+            self.check_compilation()
+            self.check_runtime()
+
+        def check_compilation(self):
+            try:
+                if len(self.compile_msgs) > 0:
+                    raise TemplateCompilationError('\n'.join(self.compile_msgs))
+            finally:
+                self.compile_msgs = []
+
+        def check_runtime(self):
+            try:
+                if len(self.runtime_msgs) > 0:
+                    raise TemplateRenderError('\n'.join(self.runtime_msgs))
+            finally:
+                self.runtime_msgs = []
+
+    def __init__(self, name, group_file_path, *args, **kwargs):
+        """
+        :param name: The name of the template to render within the group file
+        :param group_file_path: the group file the template resides in
+        :param java_model: Render from the model converted into Java
+         collections, which StringTemplate reads without calling back into
+         python
+        """
+        self.name = name
+        self.group_file_path = group_file_path
+        self.java_model = kwargs.pop('java_model', False)
+        self._listener = self.ErrorListener()
+        super(STTemplate, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return self.__unicode__().encode('utf-8')
+
+    def __unicode__(self):
+        return "%s (%s)" % (self.name, self.group_file_path)
+
+    @property
+    def last_modified(self):
+        return os.stat(self.group_file_path)[ST_MTIME]
+
+    def dependencies(self):
+        deps = super(STTemplate, self).dependencies()
+        deps.add(os.path.abspath(self.group_file_path))
+        return deps
+
+    def build_inputs(self):
+        inputs = super(STTemplate, self).build_inputs()
+        try:
+            inputs['group'] = hash_file(self.group_file_path)
+        except (IOError, OSError) as e:
+            raise InvalidConfigurationError(
+                "Cannot open string template group file %s: %s" %
+                (self.group_file_path, e))
+        return inputs
+
+    @property
+    def _st_template(self):
+        if not hasattr(self, '_inst'):
+            stg = group_cache.get(self.group_file_path)
+            self._inst = stg.getInstanceOf(self.name)
+            if self._inst is None:
+                raise InvalidConfigurationError(
+                    "Template %s is not defined in group file %s" %
+                    (self.name, self.group_file_path))
+
+        return self._inst
+
+    def model_keys(self):
+        impl = self._st_template.impl
+        if not impl.hasFormalArgs:
+            return None
+        if impl.formalArguments is None:
+            return []
+
+        return list(impl.formalArguments.keySet())
+
+    def _inject_model(self):
+        keys = self.model_keys()
+        if self.java_model:
+            data = self.model.java_data
+            if keys is None:
+                keys = list(data.keySet())
+            items = [(k, data.get(k)) for k in keys if data.containsKey(k)]
+        elif keys is None:
+            items = self.model.items()
+        else:
+            items = [(k, self.model[k]) for k in keys if k in self.model]
+
+        for k,v in items:
+            try:
+                self._st_template.add(k, v)
+            except java.lang.IllegalArgumentException as e:
+                pass
+
+    def render(self):
+        with build_stats.phase('model injection'):
+            self._inject_model()
+
+        # Render with this template's own listener since the group, and the
+        # listener it was compiled with, is shared with other templates.
+        with build_stats.phase('render'):
+            out = StringWriter()
+            self._st_template.write(AutoIndentWriter(out), self._listener)
+            result = out.toString()
+
+        # This will throw an exception upon errors
+        self._listener.check_errors()
+        
+        return result
+
+    def render_chunks(self, spool_dir=None):
+        """
+        Renders straight into a spool file in ``spool_dir`` through a Java
+        writer, so that the output never has to be in memory as one string,
+        and then streams it back out of the file.
+        """
+        with build_stats.phase('model injection'):
+            self._inject_model()
+
+        fd, spool_path = tempfile.mkstemp(prefix='.codegen-st-', dir=spool_dir)
+        os.close(fd)
+        try:
+            with build_stats.phase('render'):
+                out = BufferedWriter(OutputStreamWriter(
+                        FileOutputStream(spool_path), 'UTF-8'))
+                try:
+                    self._st_template.write(AutoIndentWriter(out),
+                                            self._listener)
+                finally:
+                    out.close()
+
+            self._listener.check_errors()
+
+            for chunk in read_chunks(spool_path, encoding='utf-8'):
+                yield chunk
+        finally:
+            os.remove(spool_path)
+
+    @classmethod
+    def from_config(cls, name, template_dir, *args, **kwargs):
+        group_file_path = os.path.join(template_dir, name + '.stg')
+        return cls(name, group_file_path, *args, **kwargs)
+
+    @classmethod
+    def options(cls, config):
+        return {'java_model': config['java_model']}
+
+    @classmethod
+    def render_path_renderer(cls, render_path):
+        # Compile the render path once and copy it for every render
+        compiled = ST(render_path)
+
+        def render(attributes):
+            return inject_st_with_dict(ST(compiled), attributes).render()
+
+        return render
+
+
+class STGroupCache(object):
+    """
+    A cache of compiled StringTemplate groups keyed by group file path and
+    modification time.  Each group file is loaded, configured with the model
+    adaptor and renderers and compiled once, after which every
+    :class:`STTemplate` in that group only has to call ``getInstanceOf``.
+    """
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, group_file_path):
+        with self._lock:
+            return self._get(group_file_path)
+
+    def _get(self, group_file_path):
+        path = os.path.abspath(group_file_path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            raise InvalidConfigurationError(
+                "Cannot open string template group file %s: %s" %
+                (group_file_path, e))
+
+        cached = self._groups.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        stg = self._compile(path)
+        self._groups[path] = (mtime, stg)
+
+        return stg
+
+    def _compile(self, path):
+        with build_stats.phase('group compile'):
+            return self._compile_group(path)
+
+    def _compile_group(self, path):
+        listener = STTemplate.ErrorListener()
+        try:
+            stg = STGroupFile(path)
+            stg.setListener(listener)
+            stg.registerModelAdaptor(dict, STTemplate.DictModelAdaptor())
+            stg.registerRenderer(String, StringRenderer())
+            stg.load()
+        except java.lang.IllegalArgumentException as e:
+            raise InvalidConfigurationError(
+                "Cannot open string template group file %s: %s" % (path, e))
+
+        listener.check_compilation()
+
+        return stg
+
+    def clear(self):
+        self._groups.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Compiled groups are shared by every template rendered in the process
+group_cache = STGroupCache()
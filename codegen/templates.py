@@ -1,37 +1,176 @@
+import hashlib
 import os
-from stat import ST_MTIME
-
-from org.stringtemplate.v4 import (
-        ST,
-        STGroupFile,
-        STGroupDir,
-        STErrorListener,
-        ModelAdaptor,
-    )
-from org.stringtemplate.v4.misc import (
-        STNoSuchPropertyException
-    )
-
-import java
-
-from .exceptions import (
-        CodegenError,
-        InvalidConfigurationError,
-        TemplateCompilationError,
-        TemplateRenderError,
-    )
+import shutil
+import tempfile
+
+from .beautifier import Beautifier
+from .exceptions import CodegenError
+from .extensions.sections import SectionIndexer, scan_sections
+from .stats import build_stats
+from .util import fingerprint, hash_file, replace_file
+
+
+class SpooledOutput(object):
+    """
+    The output of a template, streamed a chunk at a time into a file in a
+    spool directory so that it is never held in memory as a whole.  The hash
+    of the output and the index of its custom sections are worked out on the
+    way through.
+    """
+    def __init__(self, spool_dir, chunks):
+        """
+        :param spool_dir: The directory to create the spool file in
+        :param chunks: An iterable of the chunks of text of the output
+        """
+        fd, self.path = tempfile.mkstemp(dir=spool_dir)
+        digest = hashlib.sha1()
+        indexer = SectionIndexer()
+        self.size = 0
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for kind, text, name in scan_sections(self._encoded(chunks)):
+                    fh.write(text)
+                    digest.update(text)
+                    indexer.add(kind, text, name)
+                    self.size += len(text)
+        except:
+            self.discard()
+            raise
+
+        self.hash = digest.hexdigest()
+        self.sections = indexer.index
+
+    @staticmethod
+    def _encoded(chunks):
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            yield chunk
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class TemplateWriter(object):
-    def __init__(self):
-        self.template_output_pairs = []
+    """
+    Moves each output to its render path as soon as it is added.  Outputs
+    are rendered into spool files in a spool directory first, so that
+    nothing but the chunk currently being rendered is held in memory.  Files
+    whose contents would not change are left untouched so their modification
+    times are kept.
+    """
+    def __init__(self, manifest=None, spool_parent=None):
+        """
+        :param manifest: The :class:`BuildManifest` to record each output in
+         once it is in place
+        :param spool_parent: The directory to create the spool directory in.
+         It should be on the same filesystem as the outputs.
+        """
+        self.manifest = manifest
+        self.written = 0
+        self.unchanged = 0
+        self.spool_dir = tempfile.mkdtemp(prefix='.codegen-spool-',
+                dir=spool_parent)
+
+    def spool(self, chunks):
+        """
+        Returns a :class:`SpooledOutput` of the output streamed from
+        ``chunks``, which can then be added
+        """
+        return SpooledOutput(self.spool_dir, chunks)
 
     def add(self, template, output):
-        self.template_output_pairs.append((template, output))
+        """
+        Puts ``output``, a :class:`SpooledOutput` or a string, in place at the
+        render path of ``template`` unless it is already there
+        """
+        if not isinstance(output, SpooledOutput):
+            output = self.spool([output])
+
+        with build_stats.template(template), build_stats.phase('write'):
+            if template.output_matches(output.hash):
+                output.discard()
+                self.unchanged += 1
+            else:
+                self._write(template, output)
+                self.written += 1
+
+            self._written(template, output.hash, output.sections)
+
+        build_stats.add_output(template, output.size)
+
+    def _write(self, template, output):
+        try:
+            replace_file(output.path, template.render_path)
+        except (IOError, OSError) as e:
+            output.discard()
+            raise CodegenError(
+                    "Problem writing template output to file (%s): %s" %
+                    (template.render_path, e))
+
+    def _written(self, template, output_hash, sections):
+        if self.manifest is not None:
+            self.manifest.record(template, output_hash, sections)
+
+    def commit(self):
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def abort(self):
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+class TransactionalTemplateWriter(TemplateWriter):
+    """
+    Keeps every changed output staged in the spool directory and only moves
+    them to their render paths in :meth:`commit`, so that a build that fails
+    part way through leaves every output as it was.
+    """
+    def __init__(self, staging_parent, manifest=None):
+        """
+        :param staging_parent: The directory to create the staging directory
+         in.  It should be on the same filesystem as the outputs.
+        """
+        super(TransactionalTemplateWriter, self).__init__(manifest,
+                staging_parent)
+        self._staged = []
+        self._to_record = []
+
+    def _write(self, template, output):
+        self._staged.append((template, output.path))
+
+    def _written(self, template, output_hash, sections):
+        self._to_record.append((template, output_hash, sections))
+
+    def commit(self):
+        try:
+            for template, staged_path in self._staged:
+                replace_file(staged_path, template.render_path)
+        except (IOError, OSError) as e:
+            raise CodegenError(
+                    "Problem moving template output to file (%s): %s" %
+                    (template.render_path, e))
+        finally:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+        for template, output_hash, sections in self._to_record:
+            super(TransactionalTemplateWriter, self)._written(template,
+                    output_hash, sections)
+
+
+# The template classes by the ``templateType`` that selects them
+template_type_to_class = {}
+
+class TemplateType(type):
+    """
+    Registers each template class that sets ``template_type`` in
+    :data:`template_type_to_class` as soon as it is defined
+    """
+    def __init__(cls, name, bases, attrs):
+        super(TemplateType, cls).__init__(name, bases, attrs)
+        if attrs.get('template_type'):
+            template_type_to_class[attrs['template_type']] = cls
 
-    def write(self):
-        for template, output in self.template_output_pairs:
-            fh = open(template.render_path, 'w')
-            fh.write(output)
 
 class Template(object):
     """
@@ -39,180 +178,185 @@ class Template(object):
     responsible for actually loading the template from the ``name`` and
     ``dir_path`` attributes 
     """
+    __metaclass__ = TemplateType
+
+    # The name the configuration selects the subclass by with templateType
+    template_type = None
+
     renderer = None
 
+    # The manifest entry recorded for the render path by the previous build
+    build_entry = None
+
     STRING_TEMPLATE_EXTENSION = '.st'
 
     def __init__(self,
                  render_path,
                  model=None,
                  force=False,
-                 pretty=False):
+                 pretty=False,
+                 config=None):
+        """
+        :param config: The configuration entry the template was created from
+        """
         self.model = model
         self.render_path = render_path
         self.force = force
         self.pretty = pretty
+        self.config = config
 
-    def needs_render(self):
+    @classmethod
+    def from_config(cls, name, template_dir, *args, **kwargs):
         """
-        Returns `True` if the file at `render_path` is older than the
-        template file, or if ``self.force`` is true.
+        Creates the template called ``name`` in ``template_dir``, passing the
+        remaining arguments on to the constructor
         """
-        if (self.force or not os.path.exists(render_path)):
-            return True
+        raise NotImplementedError(
+                "You need to override from_config in the template subclasses")
 
-        source_stat = os.stat(template_path)
+    @classmethod
+    def options(cls, config):
+        """
+        Returns the keyword arguments of the subclass constructor that come
+        from the build configuration
+        """
+        return {}
 
-        render_stat = os.stat(render_path)
-        models_stat = os.stat(self.model.last_updated)
+    @classmethod
+    def render_path_renderer(cls, render_path):
+        """
+        Compiles ``render_path`` as a template in the syntax of the subclass
+        and returns a function that renders it with a dictionary of
+        attributes, for the render paths of fan-out templates
+        """
+        raise NotImplementedError("You need to override render_path_renderer "
+                "in the template subclasses")
 
-        if (source_stat[ST_MTIME] >= render_stat[ST_MTIME] or
-            template_info_stat[ST_MTIME] >= render_stat[ST_MTIME] or
-            models_stat[ST_MTIME] >= render_stat[ST_MTIME]):
+    def needs_render(self, manifest):
+        """
+        Returns ``True`` if ``self.force`` is true or if any of the inputs
+        recorded for ``render_path`` in the :class:`BuildManifest` have
+        changed since it was last rendered.
+        """
+        if self.force:
             return True
 
-        print "Skipping: Template older than previous render output..."
-        return False
+        return not manifest.is_current(self)
 
-    @property
-    def old_output(self):
-        if not hasattr(self, '_old_output'):
-            try:
-                with open(self.render_path, 'r') as fh:
-                    self._old_output = fh.read()
-            except IOError as e:
-                self._old_output = None
-                cw.debug("Old output does not exist at render path: %s" %
-                        (self.render_path,))
+    def build_inputs(self):
+        """
+        Returns a dictionary of hashes of everything the output of this
+        template depends on, for the build manifest.
+        """
+        # The fan-out paths and query are left out so that changing them
+        # does not invalidate the outputs of all the others
+        entry = dict((k, v) for k, v in (self.config or {}).items()
+                     if k not in ('for_model_paths', 'for_query'))
+        inputs = {
+            'config': fingerprint({
+                'entry': entry,
+                'render_path': self.render_path,
+                'pretty': bool(self.pretty),
+            }),
+        }
+        if self.pretty:
+            batcher = Beautifier.by_extension(self.render_path)
+            if batcher is not None:
+                inputs['formatter'] = batcher.beautifier.fingerprint()
+
+        return inputs
+
+    def dependencies(self):
+        """
+        The set of absolute paths of the files the output depends on
+        """
+        return set(getattr(self.model, 'source_paths', []))
 
-        return self._old_output
+    def model_keys(self):
+        """
+        The top level model keys the template is able to read, or ``None`` if
+        it can read all of them.
+        """
+        return None
 
-    @old_output.deleter
-    def old_output(self):
-        del self._old_output
+    def model_fingerprint(self):
+        """
+        A hash of the part of the model the output depends on: the keys the
+        template reads from its model or (sub)model view.
+        """
+        keys = self.model_keys()
+        try:
+            if keys is not None:
+                return self.model.fingerprint_keys(keys)
+            return self.model.fingerprint
+        except AttributeError:
+            return fingerprint(self.model)
 
-    def render(self):
-        raise NotImplementedError(
-                "You need to override render in the template subclasses")
+    def model_source_fingerprint(self):
+        """
+        A cheap hash of the whole source the model comes from, if it has one.
+        When this is unchanged nothing in the model can have changed.
+        """
+        return getattr(self.model, 'source_fingerprint', None)
+
+    def _current_build_entry(self):
+        """
+        Returns :attr:`build_entry` if the output on disk is still the one it
+        was recorded for, otherwise ``None``.
+        """
+        entry = self.build_entry
+        if entry is None:
+            return None
 
-    def write_to_render_path(self, output):
         try:
-            with open(self.render_path, 'w') as fh:
-                fh.write(output)
-        except IOError as e:
-            raise CodegenError(
-                    "Problem writing template output to file (%s): %s" %
-                    (self.render_path, e))
+            out_stat = os.stat(self.render_path)
+        except OSError as e:
+            return None
 
-        del self.old_output
+        if (out_stat.st_size != entry.get('size') or
+                out_stat.st_mtime != entry.get('mtime')):
+            return None
 
-class STTemplate(Template):
-    """
-    A StringTemplate template wrapper
-    """
-    class DictModelAdaptor(ModelAdaptor):
-        def getProperty(self, interp, tmpl, o, propertyObj, propertyName):
-            try:
-                return o[propertyName]
-            except KeyError:
-                return None
-                #raise STNoSuchPropertyException(None, o, propertyName)
-
-
-    class ErrorListener(STErrorListener):
-        def __init__(self):
-            self.compile_msgs = []
-            self.runtime_msgs = []
-
-        def compileTimeError(self, msg):
-            self.compile_msgs.append(str(msg))
-
-        def runTimeError(self, msg):
-            self.runtime_msgs.append(str(msg))
-
-        def IOError(self, msg):
-            self.io_errors.append(str(msg))
-
-        def internalError(self, msg):
-            self.internal_errors.append(str(msg))
-
-        def check_errors(self):
-            self.check_compilation()
-            self.check_runtime()
-
-        def check_compilation(self):
-            try:
-                if len(self.compile_msgs) > 0:
-                    raise TemplateCompilationError('\n'.join(self.compile_msgs))
-            finally:
-                self.compile_msgs = []
-
-        def check_runtime(self):
-            try:
-                if len(self.runtime_msgs) > 0:
-                    raise TemplateRenderError('\n'.join(self.runtime_msgs))
-            finally:
-                self.runtime_msgs = []
-
-    def __init__(self, name, group_file_path, *args, **kwargs):
-        """
-        :param name: The name of the template to render within the group file
-        :param group_file_path: the group file the template resides in
-        """
-        self.name = name
-        self.group_file_path = group_file_path
-        self._listener = self.ErrorListener()
-        super(STTemplate, self).__init__(*args, **kwargs)
-
-    def __str__(self):
-        return self.__unicode__().encode('utf-8')
-
-    def __unicode__(self):
-        return "%s (%s)" % (self.name, self.group_file_path)
-
-    @property
-    def last_modified(self):
-        return os.stat(self.group_file_path)[ST_MTIME]
-
-    @property
-    def _st_template(self):
-        if not hasattr(self, '_inst'):
-            try:
-                stg = STGroupFile(self.group_file_path)
-                stg.setListener(self._listener)
-                stg.registerModelAdaptor(dict, STTemplate.DictModelAdaptor())
-
-                from org.stringtemplate.v4 import StringRenderer
-                from java.lang import String
-                stg.registerRenderer(String, StringRenderer())
-
-                self._inst = stg.getInstanceOf(self.name)
-                self._listener.check_compilation()
-            except java.lang.IllegalArgumentException as e:
-                raise InvalidConfigurationError(
-                    "Cannot open string template group file for template %s: %s" %
-                    (self.name, e,))
-
-        return self._inst
-
-    def _inject_model(self):
-        for k,v in self.model.items():
-            try:
-                self._st_template.add(k, v)
-            except java.lang.IllegalArgumentException as e:
-                pass
+        return entry
+
+    def section_index(self):
+        """
+        The custom sections recorded for the current output as a list of
+        ``[name, start, end, hash]`` byte ranges of their content, or
+        ``None`` if there is no record that is known to be up to date.
+        """
+        entry = self._current_build_entry()
+        if entry is None:
+            return None
+
+        return entry.get('sections')
+
+    def output_matches(self, output_hash):
+        """
+        Returns ``True`` if the output on disk is the one with the hash
+        ``output_hash``.  The recorded hash is used when it is up to date, so
+        the file does not have to be read back.
+        """
+        entry = self._current_build_entry()
+        if entry is not None and entry.get('output') is not None:
+            return entry['output'] == output_hash
+
+        try:
+            return hash_file(self.render_path) == output_hash
+        except (IOError, OSError) as e:
+            return False
 
     def render(self):
-        self._inject_model()
-        result = self._st_template.render()
+        raise NotImplementedError(
+                "You need to override render in the template subclasses")
 
-        # This will throw an exception upon errors
-        self._listener.check_errors()
-        
-        return result
+    def render_chunks(self, spool_dir=None):
+        """
+        Renders the template as an iterable of chunks of text.  Subclasses
+        that can render without holding the whole output in memory override
+        this; by default it is all rendered at once with :meth:`render`.
 
-    @classmethod
-    def from_config(cls, name, template_dir, *args, **kwargs):
-        group_file_path = os.path.join(template_dir, name + '.stg')
-        return cls(name, group_file_path, *args, **kwargs)
+        :param spool_dir: The directory to keep any temporary files in
+        """
+        yield self.render()
 
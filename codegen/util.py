@@ -1,8 +1,24 @@
+import errno
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
 import yaml
 
+# The LibYAML based loader is many times faster, but is only there when
+# PyYAML was built against LibYAML (and never under Jython)
+YAMLLoader = getattr(yaml, 'CLoader', yaml.Loader)
+
+# The size of the pieces files and outputs are streamed in
+CHUNK_SIZE = 64 * 1024
+
 def load_yaml(path):
     fd = open(path, 'r')
-    d = yaml.load(fd)
+    d = yaml.load(fd, Loader=YAMLLoader)
     fd.close()
 
     return d
@@ -16,4 +32,147 @@ def inject_st_with_dict(template, dct):
         template.add(k, v)
 
     return template
-        
+
+def hash_text(text):
+    """
+    Returns a hex digest of a string
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+def fingerprint(obj):
+    """
+    Returns a stable hex digest of a model or any other JSON-like structure,
+    independent of the ordering of its dictionaries.
+    """
+    return hash_text(json.dumps(obj, sort_keys=True, default=str))
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def hash_file(path):
+    """
+    Returns a hex digest of the contents of the file at ``path``.  Digests are
+    remembered for as long as the size and modification time of the file
+    stay the same.
+    """
+    path = os.path.abspath(path)
+    file_stat = os.stat(path)
+    key = (file_stat.st_mtime, file_stat.st_size)
+
+    with _file_hashes_lock:
+        cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+
+    with _file_hashes_lock:
+        _file_hashes[path] = (key, digest.hexdigest())
+
+    return digest.hexdigest()
+
+def clear_file_hashes():
+    """
+    Forgets every remembered file digest, as a new process would
+    """
+    with _file_hashes_lock:
+        _file_hashes.clear()
+
+def read_chunks(path, encoding=None, size=CHUNK_SIZE):
+    """
+    Yields the contents of the file at ``path`` a chunk at a time, decoded
+    from ``encoding`` if given
+    """
+    if encoding is None:
+        fh = open(path, 'rb')
+    else:
+        fh = io.open(path, 'r', encoding=encoding, newline='')
+
+    with fh:
+        while True:
+            chunk = fh.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+def coalesce_chunks(chunks, size=CHUNK_SIZE):
+    """
+    Joins runs of small chunks of text into chunks of at least ``size``
+    characters, apart from the last
+    """
+    pieces = []
+    length = 0
+    for chunk in chunks:
+        pieces.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield u''.join(pieces)
+            pieces = []
+            length = 0
+
+    if pieces:
+        yield u''.join(pieces)
+
+def atomic_write(path, text, binary=False):
+    """
+    Writes ``text`` to a temporary file next to ``path`` and renames it over
+    ``path``, so that a crash never leaves a partially written file behind.
+    """
+    dir_path, filename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % (filename,), dir=dir_path)
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as fh:
+            fh.write(text)
+
+        replace_file(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _current_umask():
+    # The umask can only be read by setting it
+    umask = os.umask(022)
+    os.umask(umask)
+    return umask
+
+# The umask of the process, which new outputs are created with
+UMASK = _current_umask()
+
+def replace_file(src, dst):
+    """
+    Moves ``src`` over ``dst`` atomically, keeping the permissions of the
+    file being replaced, or giving a new file the default permissions of the
+    umask.  When they are on different filesystems ``src`` is copied next
+    to ``dst`` first, so that ``dst`` is still replaced by a single rename.
+    """
+    try:
+        mode = os.stat(dst).st_mode & 07777
+    except OSError as e:
+        mode = 0666 & ~UMASK
+    os.chmod(src, mode)
+
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+        dir_path, filename = os.path.split(os.path.abspath(dst))
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % (filename,),
+                                        dir=dir_path)
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, dst)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.remove(src)
@@ -0,0 +1,97 @@
+import glob
+import os
+import time
+
+from .consolewriter import cw
+from .exceptions import CodegenError
+
+"""
+Watch mode, which keeps a :class:`Builder` alive and re-renders only the
+templates that depend on files that have changed.
+"""
+
+class Watcher(object):
+    """
+    Polls the config file, the group files in the template directory and
+    the files every template depends on, and re-renders the templates
+    affected by each change.  The builder is kept between changes so only
+    models and groups that actually changed are loaded again.
+    """
+    def __init__(self, config_file, load_config, interval=1.0):
+        """
+        :param config_file: The path of the configuration file
+        :param load_config: A callable that returns a fresh merged config
+        :param interval: The number of seconds between polls
+        """
+        self.config_file = os.path.abspath(config_file)
+        self.load_config = load_config
+        self.interval = interval
+        self.builder = None
+
+    def watched_paths(self):
+        paths = set([self.config_file])
+        if self.builder is None:
+            return paths
+
+        template_dir = self.builder.config['template_dir']
+        paths.update(os.path.abspath(p)
+                     for p in glob.glob(os.path.join(template_dir, '*.stg')))
+        for t in self.builder.templates:
+            paths.update(t.dependencies())
+
+        return paths
+
+    @staticmethod
+    def snapshot(paths):
+        stats = {}
+        for path in paths:
+            try:
+                file_stat = os.stat(path)
+                stats[path] = (file_stat.st_mtime, file_stat.st_size)
+            except OSError as e:
+                stats[path] = None
+
+        return stats
+
+    def rebuild(self, changed):
+        """
+        Renders whatever ``changed`` affects, or everything if the config
+        itself changed
+        """
+        if self.builder is None or self.config_file in changed:
+            from .renderer import Builder
+            self.builder = Builder(self.load_config())
+            self.builder.render_templates()
+            return
+
+        # Expand the templates again since a changed model can change the
+        # fan-out of the templates that use it
+        self.builder.reset()
+        affected = [t for t in self.builder.templates
+                    if t.dependencies() & changed]
+        if affected:
+            self.builder.render_templates(affected)
+
+    def watch(self):
+        changed = set([self.config_file])
+        stats = {}
+        while True:
+            if changed:
+                cw.output("Change detected in: %s" %
+                        (', '.join(sorted(changed)),))
+                # Files that change while rendering are compared against
+                # their state from before the rebuild, so they are not missed
+                before = self.snapshot(self.watched_paths())
+                try:
+                    self.rebuild(changed)
+                except CodegenError as e:
+                    cw.error(str(e))
+                stats = self.snapshot(self.watched_paths())
+                stats.update(before)
+
+            time.sleep(self.interval)
+
+            current = self.snapshot(self.watched_paths())
+            changed = set(path for path, value in current.items()
+                          if stats.get(path) != value)
+            stats = current
@@ -5,5 +5,5 @@ setup(name="CodeGen",
       summary="Code generator",
       author=u'Ben Keith',
       author_email=u'keitwb@gmail.com',
-      scripts=['scripts/codegen']
+      scripts=['scripts/codegen', 'scripts/codegen-client']
 )
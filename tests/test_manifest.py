@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from codegen.manifest import BuildManifest
+from codegen.models import ModelRegistry, TemplateModel
+from codegen.templates import Template
+from codegen.util import hash_file
+
+
+class FakeTemplate(Template):
+    """
+    A template whose own source is represented by ``template_hash``
+    """
+    template_hash = 'v1'
+
+    def build_inputs(self):
+        inputs = super(FakeTemplate, self).build_inputs()
+        inputs['template'] = self.template_hash
+        return inputs
+
+
+class IsCurrentTest(unittest.TestCase):
+    MODEL = {
+        'tables': {
+            'a': {'name': 'a', 'columns': ['id']},
+            'b': {'name': 'b', 'columns': ['id', 'x']},
+        },
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.model_file = os.path.join(self.tmp_dir, 'model.yaml')
+        self.registry = ModelRegistry()
+        self.write_model(self.MODEL)
+        self.manifest = BuildManifest(os.path.join(self.tmp_dir, 'manifest'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_model(self, data):
+        with open(self.model_file, 'w') as fh:
+            yaml.safe_dump(data, fh)
+        # The registry notices a change by the size and modification time
+        self.bump_mtime(self.model_file)
+
+    def bump_mtime(self, path):
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+
+    def template(self, model_path='tables.a', **kwargs):
+        model = TemplateModel.from_file(self.model_file, self.registry)
+        render_path = os.path.join(self.tmp_dir, 'A.java')
+        return FakeTemplate(render_path, model.view(model_path),
+                            config={'name': 'table'}, **kwargs)
+
+    def render(self, template, text='class A {}'):
+        with open(template.render_path, 'w') as fh:
+            fh.write(text)
+        self.manifest.record(template, hash_file(template.render_path))
+
+    def test_unrecorded(self):
+        self.assertFalse(self.manifest.is_current(self.template()))
+
+    def test_unchanged(self):
+        self.render(self.template())
+        self.assertTrue(self.manifest.is_current(self.template()))
+
+        # Also once saved and loaded again
+        self.manifest.save()
+        manifest = BuildManifest(self.manifest.path)
+        self.assertTrue(manifest.is_current(self.template()))
+
+    def test_other_subtree_changed(self):
+        self.render(self.template())
+        model = dict(self.MODEL)
+        model['tables'] = dict(model['tables'], b={'name': 'b2'})
+        self.write_model(model)
+        self.assertTrue(self.manifest.is_current(self.template()))
+
+    def test_own_subtree_changed(self):
+        self.render(self.template())
+        model = dict(self.MODEL)
+        model['tables'] = dict(model['tables'], a={'name': 'a', 'columns': []})
+        self.write_model(model)
+        self.assertFalse(self.manifest.is_current(self.template()))
+
+    def test_template_changed(self):
+        self.render(self.template())
+        template = self.template()
+        template.template_hash = 'v2'
+        self.assertFalse(self.manifest.is_current(template))
+
+    def test_configuration_changed(self):
+        self.render(self.template())
+        self.assertFalse(self.manifest.is_current(self.template(pretty=True)))
+
+    def test_output_changed(self):
+        template = self.template()
+        self.render(template)
+        with open(template.render_path, 'w') as fh:
+            fh.write('class A { int edited; }')
+        self.assertFalse(self.manifest.is_current(self.template()))
+
+    def test_output_touched(self):
+        template = self.template()
+        self.render(template)
+        self.bump_mtime(template.render_path)
+        self.assertTrue(self.manifest.is_current(self.template()))
+
+    def test_output_deleted(self):
+        template = self.template()
+        self.render(template)
+        os.remove(template.render_path)
+        self.assertFalse(self.manifest.is_current(self.template()))
+
+
+if __name__ == '__main__':
+    unittest.main()
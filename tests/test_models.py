@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from codegen.config import (
+        CommandLineConfig,
+        DefaultConfig,
+        FileConfig,
+        MergedConfig,
+    )
+from codegen.exceptions import InvalidConfigurationError, ModelPathError
+from codegen.models import (
+        DictModelSource,
+        ModelRegistry,
+        TemplateModel,
+        resolve_selector,
+    )
+from codegen.renderer import Builder
+
+MODEL = {
+    'tables': {
+        'b': {'name': 'b', 'columns': [{'name': 'id'}, {'name': 'x'}]},
+        'a': {'name': 'a', 'columns': []},
+        'c': {'name': 'c', 'columns': [{'name': 'id'}]},
+    },
+    'modules': {
+        'm1': {'entities': {'e1': {}, 'e2': {}}},
+        'm2': {'entities': {'e3': {}}},
+    },
+    'names': ['x', 'y'],
+    'version': 3,
+}
+
+
+class ResolveTest(unittest.TestCase):
+    def setUp(self):
+        self.model = TemplateModel(DictModelSource(MODEL))
+
+    def test_wildcard_matches_keys_in_order(self):
+        self.assertEqual(self.model.resolve('tables.*'),
+                         ['tables.a', 'tables.b', 'tables.c'])
+
+    def test_nested_wildcards(self):
+        self.assertEqual(self.model.resolve('modules.*.entities.*'),
+                         ['modules.m1.entities.e1', 'modules.m1.entities.e2',
+                          'modules.m2.entities.e3'])
+
+    def test_list_items_by_index(self):
+        self.assertEqual(self.model.resolve('tables.b.columns.*'),
+                         ['tables.b.columns.0', 'tables.b.columns.1'])
+
+    def test_slices(self):
+        self.assertEqual(self.model.resolve('tables[0:2]'),
+                         ['tables.a', 'tables.b'])
+        self.assertEqual(self.model.resolve('tables[1:]'),
+                         ['tables.b', 'tables.c'])
+        self.assertEqual(self.model.resolve('tables[-1]'), ['tables.c'])
+        self.assertEqual(self.model.resolve('tables.*.columns[0]'),
+                         ['tables.b.columns.0', 'tables.c.columns.0'])
+
+    def test_exact_path(self):
+        self.assertEqual(self.model.resolve('tables.a'), ['tables.a'])
+        self.assertRaises(ModelPathError, self.model.resolve, 'nope.a')
+
+    def test_no_match_is_an_error(self):
+        for selector in ('nope.*', 'tables[5]', 'tables[5:]',
+                         'tables.a.columns.*', 'tables.*.nope'):
+            self.assertRaises(ModelPathError, self.model.resolve, selector)
+
+    def test_invalid_element(self):
+        self.assertRaises(ModelPathError, self.model.resolve, 'tables[x]')
+
+    def test_leaves_are_not_matched(self):
+        # Only maps and lists are matched, never the scalars in them
+        self.assertEqual(self.model.resolve('*'),
+                         ['modules', 'names', 'tables'])
+        self.assertEqual(resolve_selector('names.*', self.model._children,
+                                          self.model._is_node), [])
+
+
+class FanOutTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'tmpl'))
+        with open(os.path.join(self.tmp_dir, 'tmpl', 'grp.jinja'), 'w') as fh:
+            fh.write('{{ modelKey }}')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def builder(self, model, selectors):
+        model_file = os.path.join(self.tmp_dir, 'model.yaml')
+        with open(model_file, 'w') as fh:
+            yaml.safe_dump(model, fh)
+
+        config_file = os.path.join(self.tmp_dir, 'codegen.yaml')
+        with open(config_file, 'w') as fh:
+            yaml.safe_dump({
+                'templateDir': os.path.join(self.tmp_dir, 'tmpl'),
+                'templateType': 'jinja',
+                'modelFile': model_file,
+                'templates': [{
+                    'name': 'grp',
+                    'renderPath': 'out/{{ modelKey }}.java',
+                    'forModelPaths': selectors,
+                }],
+            }, fh)
+
+        config = MergedConfig(
+                CommandLineConfig(['-d', self.tmp_dir, '-c', config_file]),
+                FileConfig(config_file), DefaultConfig())
+        return Builder(config, ModelRegistry())
+
+    def test_maps_are_fanned_out(self):
+        builder = self.builder({'groups': {'a': {}, 'b': {'x': 1}}},
+                               ['groups.*'])
+        self.assertEqual([t.render_path for t in builder.templates],
+                         ['out/a.java', 'out/b.java'])
+
+    def test_list_node_is_an_error(self):
+        builder = self.builder({'groups': {'a': {}, 'b': [1, 2]}},
+                               ['groups.*'])
+        with self.assertRaises(InvalidConfigurationError) as cm:
+            builder.templates
+        self.assertIn("'groups.b'", str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import itertools
+import threading
+import time
+import unittest
+
+from codegen.pool import OrderedPool
+
+
+class Counter(object):
+    """
+    A thread safe record of the items a test has handed out or started
+    """
+    def __init__(self):
+        self.items = []
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        with self._lock:
+            self.items.append(item)
+
+    def counting(self, items):
+        for item in items:
+            self.add(item)
+            yield item
+
+
+class OrderedPoolTest(unittest.TestCase):
+    def test_results_are_in_item_order(self):
+        # The earlier items take the longest, so they finish last
+        def func(i):
+            time.sleep((10 - i) * 0.01)
+            return i * i
+
+        results = list(OrderedPool(4).imap(func, range(10)))
+        self.assertEqual(results, [i * i for i in range(10)])
+
+    def test_single_job_runs_in_caller(self):
+        threads = []
+
+        def func(i):
+            threads.append(threading.current_thread())
+            return i
+
+        self.assertEqual(list(OrderedPool(1).imap(func, range(5))),
+                         range(5))
+        self.assertEqual(set(threads), set([threading.current_thread()]))
+
+    def test_empty(self):
+        self.assertEqual(list(OrderedPool(3).imap(lambda i: i, [])), [])
+
+    def test_first_error_stops_new_work(self):
+        started = Counter()
+
+        def func(i):
+            started.add(i)
+            if i == 5:
+                raise ValueError(i)
+            time.sleep(0.01)
+            return i
+
+        pool = OrderedPool(3)
+        results = []
+        with self.assertRaises(ValueError):
+            for result in pool.imap(func, itertools.count()):
+                results.append(result)
+
+        # Results that were ready before the failure may be handed back,
+        # but never any after it
+        self.assertEqual(results, range(len(results)))
+        self.assertTrue(len(results) <= 5)
+        # The items are endless, so the run only ends if the failure stopped
+        # the workers from taking more of them
+        self.assertTrue(max(started.items) < 5 + pool.window + pool.jobs,
+                        started.items)
+
+    def test_earliest_failure_is_raised(self):
+        def func(i):
+            if i == 2:
+                time.sleep(0.2)
+                raise ValueError(i)
+            if i == 4:
+                raise KeyError(i)
+            return i
+
+        with self.assertRaises(ValueError):
+            list(OrderedPool(4).imap(func, range(8)))
+
+    def test_error_from_items_is_raised(self):
+        def items():
+            yield 1
+            yield 2
+            raise KeyError('items')
+
+        with self.assertRaises(KeyError):
+            list(OrderedPool(2).imap(lambda i: i, items()))
+
+    def test_workers_stay_within_window(self):
+        pulled = Counter()
+        pool = OrderedPool(2, window=3)
+        results = pool.imap(lambda i: i, pulled.counting(itertools.count()))
+        try:
+            self.assertEqual(next(results), 0)
+            time.sleep(0.3)
+            # One result has been handed back, so at most one window more
+            # than that can have been taken
+            self.assertTrue(len(pulled.items) <= 1 + pool.window,
+                            pulled.items)
+
+            self.assertEqual([next(results) for i in range(5)], range(1, 6))
+        finally:
+            results.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from codegen.extensions.sections import (
+        SECTION_CONTENT,
+        SECTION_END,
+        SECTION_REGEX,
+        SECTION_START,
+        CustomSection,
+        CustomSectionsExtension,
+        SectionIndexer,
+        read_sections,
+        scan_sections,
+        tokenize,
+    )
+
+# The pieces random texts are made of, including delimiters that are
+# incomplete, malformed or have no end
+PIECES = [
+    u'public class Foo {\n',
+    u'    int x;\n',
+    u'// ',
+    u'[[@ section a @]]',
+    u'[[@ section b-2 @]]',
+    u'[[@ section c_3 @]]',
+    u'[[@ end @]]',
+    u'[[@ end @]]',
+    u'[[@ sec',
+    u'[[@ end',
+    u'[[@ section bad name @]]',
+    u'[[',
+    u'@]]',
+    u'[',
+    u'caf\xe9 ',
+    u'\n',
+]
+
+RUNS = 300
+
+
+def random_text(rand, length=30):
+    return u''.join(rand.choice(PIECES) for i in range(length))
+
+def random_chunks(rand, text):
+    """
+    Splits ``text`` at random, mostly into very small chunks so that
+    delimiters are split in every possible place
+    """
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rand.choice([1, 1, 2, 3, 5, 8, 13, len(text)])
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+def _add_text(tokens, text):
+    if tokens and tokens[-1][0] == 'text':
+        tokens[-1] = ('text', tokens[-1][1] + text)
+    elif text:
+        tokens.append(('text', text))
+
+def scanned(chunks):
+    """
+    The tokens of :func:`scan_sections` in the form of :func:`expected`
+    """
+    tokens = []
+    section = None
+    for kind, text, name in scan_sections(chunks):
+        if kind == SECTION_START:
+            section = [name, text, []]
+        elif kind == SECTION_CONTENT:
+            section[2].append(text)
+        elif kind == SECTION_END:
+            tokens.append(('section', section[0], u''.join(section[2])))
+            section = None
+        else:
+            _add_text(tokens, text)
+
+    # A section that never ends is plain text
+    if section is not None:
+        _add_text(tokens, section[1] + u''.join(section[2]))
+
+    return tokens
+
+def expected(text):
+    """
+    The text and sections :data:`SECTION_REGEX` finds in ``text``
+    """
+    tokens = []
+    for token in tokenize(text):
+        if isinstance(token, CustomSection):
+            tokens.append(('section', token.name, token.content))
+        else:
+            _add_text(tokens, token)
+    return tokens
+
+
+class ScanSectionsTest(unittest.TestCase):
+    def test_matches_regex_for_any_chunking(self):
+        rand = random.Random(1)
+        for i in range(RUNS):
+            text = random_text(rand)
+            chunks = random_chunks(rand, text)
+            self.assertEqual(scanned(chunks), expected(text),
+                             "chunks: %r" % (chunks,))
+
+    def test_tokens_cover_the_text(self):
+        rand = random.Random(2)
+        for i in range(RUNS):
+            text = random_text(rand)
+            tokens = scan_sections(random_chunks(rand, text))
+            self.assertEqual(u''.join(t[1] for t in tokens), text)
+
+    def test_unterminated_section(self):
+        text = u'a [[@ section x @]] b [[@ end'
+        self.assertEqual(scanned([text[:4], text[4:]]), [('text', text)])
+
+    def test_index_matches_regex(self):
+        rand = random.Random(3)
+        for i in range(RUNS):
+            data = random_text(rand).encode('utf-8')
+            indexer = SectionIndexer()
+            for kind, text, name in scan_sections(random_chunks(rand, data)):
+                indexer.add(kind, text, name)
+
+            self.assertEqual(indexer.index, [
+                    [m.group('name'), m.start('content'), m.end('content'),
+                     hashlib.sha1(m.group('content')).hexdigest()]
+                    for m in SECTION_REGEX.finditer(data)])
+
+
+class ReadSectionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reads_indexed_sections(self):
+        data = (u'x [[@ section a @]]caf\xe9[[@ end @]] y '
+                u'[[@ section b @]][[@ end @]]').encode('utf-8')
+        path = os.path.join(self.tmp_dir, 'out.java')
+        with open(path, 'wb') as fh:
+            fh.write(data)
+
+        indexer = SectionIndexer()
+        for token in scan_sections([data]):
+            indexer.add(*token)
+
+        sections = read_sections(path, indexer.index)
+        self.assertEqual(sorted(sections), ['a', 'b'])
+        self.assertEqual(sections['a'].content, u'caf\xe9'.encode('utf-8'))
+        self.assertEqual(sections['b'].content, '')
+
+        # An index that no longer matches the file is not used
+        with open(path, 'wb') as fh:
+            fh.write(data.replace('caf', 'CAF'))
+        self.assertEqual(read_sections(path, indexer.index), None)
+
+
+class ReplaceSectionsTest(unittest.TestCase):
+    EXISTING = {
+        'a': u'\n    custom caf\xe9 code\n'.encode('utf-8'),
+        'c_3': '',
+    }
+
+    def extension(self, existing):
+        ext = CustomSectionsExtension(None)
+        ext.existing_sections = dict((name, CustomSection(name, content))
+                                     for name, content in existing.items())
+        return ext
+
+    def reference(self, text, existing):
+        def replace(match):
+            name = match.group('name')
+            if name not in existing:
+                return match.group(0)
+            return u'[[@ section %s @]]%s[[@ end @]]' % (name,
+                    existing[name].decode('utf-8'))
+        return SECTION_REGEX.sub(replace, text)
+
+    def test_matches_regex_for_any_chunking(self):
+        rand = random.Random(4)
+        ext = self.extension(self.EXISTING)
+        for i in range(RUNS):
+            text = random_text(rand)
+            chunks = random_chunks(rand, text)
+            self.assertEqual(u''.join(ext.replace_section_chunks(chunks)),
+                             self.reference(text, self.EXISTING),
+                             "chunks: %r" % (chunks,))
+
+    def test_whole_text(self):
+        rand = random.Random(5)
+        ext = self.extension(self.EXISTING)
+        for i in range(RUNS):
+            text = random_text(rand)
+            self.assertEqual(ext.replace_sections(text),
+                             self.reference(text, self.EXISTING))
+
+    def test_no_existing_sections_passes_chunks_through(self):
+        chunks = [u'a [[@ sec', u'tion a @]] b [[@ end @]]']
+        ext = self.extension({})
+        self.assertEqual(list(ext.replace_section_chunks(chunks)), chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from codegen.exceptions import CodegenError, InvalidConfigurationError
+from codegen.manifest import MANIFEST_FILENAME, BuildManifest
+from codegen.shard import (
+        assign,
+        merge_shards,
+        parse_shard,
+        shard_manifest_path,
+    )
+from codegen.util import hash_file
+
+
+class FakeTemplate(object):
+    def __init__(self, render_path):
+        self.render_path = render_path
+
+    def __repr__(self):
+        return 'FakeTemplate(%r)' % (self.render_path,)
+
+
+def paths(shards):
+    return [sorted(t.render_path for t in shard) for shard in shards]
+
+
+class AssignTest(unittest.TestCase):
+    def setUp(self):
+        self.templates = [FakeTemplate('out/dir%d/T%d.java' % (i % 4, i))
+                          for i in range(50)]
+
+    def test_every_template_in_one_shard(self):
+        shards = assign(self.templates, 4)
+        self.assertEqual(sorted(p for shard in paths(shards) for p in shard),
+                         sorted(t.render_path for t in self.templates))
+
+    def test_split_does_not_depend_on_order(self):
+        shuffled = list(self.templates)
+        random.Random(1).shuffle(shuffled)
+        costs = dict((t.render_path, (i % 7) * 0.1)
+                     for i, t in enumerate(self.templates))
+
+        self.assertEqual(paths(assign(self.templates, 3)),
+                         paths(assign(shuffled, 3)))
+        self.assertEqual(paths(assign(self.templates, 3, costs)),
+                         paths(assign(shuffled, 3, costs)))
+
+    def test_shards_keep_template_order(self):
+        for shard in assign(self.templates, 3):
+            indexes = [self.templates.index(t) for t in shard]
+            self.assertEqual(indexes, sorted(indexes))
+
+    def test_balanced_by_count_without_costs(self):
+        sizes = [len(shard) for shard in assign(self.templates, 4)]
+        self.assertTrue(max(sizes) - min(sizes) <= 1, sizes)
+
+    def test_balanced_by_cost(self):
+        rand = random.Random(2)
+        costs = dict((t.render_path, rand.uniform(0.01, 1.0))
+                     for t in self.templates)
+        loads = [sum(costs[t.render_path] for t in shard)
+                 for shard in assign(self.templates, 4, costs)]
+        self.assertTrue(max(loads) - min(loads) <= max(costs.values()),
+                        loads)
+
+    def test_unknown_costs_are_the_average(self):
+        # One known expensive template and three unknown ones, which cost the
+        # average (the expensive one) each
+        templates = [FakeTemplate('a.java'), FakeTemplate('b.java'),
+                     FakeTemplate('c.java'), FakeTemplate('d.java')]
+        shards = assign(templates, 2, {'a.java': 5.0})
+        self.assertEqual([len(shard) for shard in shards], [2, 2])
+
+    def test_more_shards_than_templates(self):
+        shards = assign(self.templates[:2], 4)
+        self.assertEqual(sorted(len(shard) for shard in shards), [0, 0, 1, 1])
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard(' 3 / 8 '), (3, 8))
+        for spec in ('0/2', '3/2', '1/0', 'x', '1-2'):
+            self.assertRaises(InvalidConfigurationError, parse_shard, spec)
+
+
+class MergeShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.tmp_dir, 'base')
+        os.mkdir(self.base_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def shard(self, spec, outputs, name=None):
+        """
+        Writes the ``outputs`` (render path to text) of the shard ``spec`` to
+        its own directory along with its manifest, returning the directory
+        """
+        shard_dir = os.path.join(self.tmp_dir, name or spec.replace('/', '-'))
+        os.mkdir(shard_dir)
+
+        manifest = BuildManifest(shard_manifest_path(shard_dir, spec))
+        for render_path, text in outputs.items():
+            path = os.path.join(shard_dir, render_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write(text)
+            manifest.entries[render_path] = {'output': hash_file(path)}
+        manifest.save()
+        return shard_dir
+
+    def test_merges_manifests_and_outputs(self):
+        shard_dirs = [
+            self.shard('1/2', {'out/A.java': 'a', 'out/B.java': 'b'}),
+            self.shard('2/2', {'out/C.java': 'c'}),
+        ]
+        merge_shards(self.base_dir, shard_dirs)
+
+        merged = BuildManifest(os.path.join(self.base_dir, MANIFEST_FILENAME))
+        self.assertEqual(sorted(merged.entries),
+                         ['out/A.java', 'out/B.java', 'out/C.java'])
+        for name in ('A', 'B', 'C'):
+            with open(os.path.join(self.base_dir, 'out', name + '.java')) as fh:
+                self.assertEqual(fh.read(), name.lower())
+
+    def test_overlapping_shards(self):
+        shard_dirs = [
+            self.shard('1/2', {'out/A.java': 'a'}),
+            self.shard('2/2', {'out/A.java': 'a', 'out/B.java': 'b'}),
+        ]
+        with self.assertRaises(CodegenError) as cm:
+            merge_shards(self.base_dir, shard_dirs)
+        self.assertIn('out/A.java (shards 1 and 2)', str(cm.exception))
+        self.assertFalse(os.path.exists(
+                os.path.join(self.base_dir, MANIFEST_FILENAME)))
+
+    def test_missing_shard(self):
+        shard_dirs = [self.shard('1/3', {'out/A.java': 'a'}),
+                      self.shard('3/3', {'out/C.java': 'c'})]
+        with self.assertRaises(CodegenError) as cm:
+            merge_shards(self.base_dir, shard_dirs)
+        self.assertIn('shards 2 of 3', str(cm.exception))
+
+    def test_shards_of_different_builds(self):
+        shard_dirs = [self.shard('1/2', {'out/A.java': 'a'}),
+                      self.shard('2/3', {'out/B.java': 'b'})]
+        self.assertRaises(CodegenError, merge_shards, self.base_dir,
+                          shard_dirs)
+
+    def test_changed_output(self):
+        shard_dir = self.shard('1/1', {'out/A.java': 'a'})
+        with open(os.path.join(shard_dir, 'out', 'A.java'), 'w') as fh:
+            fh.write('changed')
+        self.assertRaises(CodegenError, merge_shards, self.base_dir,
+                          [shard_dir])
+
+
+if __name__ == '__main__':
+    unittest.main()